@@ -1,4 +1,26 @@
 App = function () {
+    this.charts = {};
+    this.slots = {};
+};
+
+App.FIELD_SUFFIXES = {
+    type: '',
+    mode: '',
+    voltage: ' V',
+    current: ' A',
+    capacity: ' mAh',
+    time: '',
+    eta: '',
+    temperature: ' °C',
+    resistance: ' mΩ'
+};
+
+App.CHART_POINTS = 300;
+App.CHART_METRICS = {
+    voltage: '#337ab7',
+    current: '#e10000',
+    temperature: '#f0ad4e',
+    capacity: '#00ab00'
 };
 
 App.prototype.bind = function () {
@@ -33,8 +55,10 @@ App.prototype.bind = function () {
     setTimeout(loading, interval);
 
     var ble = function () {
-        $('.scan-result').text('Scanning... This can take a while...');
-        self.request('get', '/scan/trigger');
+        $('.scan-status').text('Scanning...');
+        $('.scan-result').empty();
+        var all = $('[data-scan-all]').prop('checked') ? 1 : 0;
+        self.request('get', '/scan/trigger?all=' + all);
     };
     $(document).on('click', '.scan button', ble);
     if ($('.scan').length) {
@@ -45,6 +69,10 @@ App.prototype.bind = function () {
         e.preventDefault();
         var selection = $(this);
         var url = '/scan/select?ble_address=' + encodeURIComponent(selection.attr('data-address'));
+        var model = selection.closest('[data-device]').find('[data-model]');
+        if (model.length) {
+            url += '&model=' + encodeURIComponent(model.val());
+        }
         self.request('get', url, null, function () {
             window.location.href = '/';
         });
@@ -58,6 +86,10 @@ App.prototype.bind = function () {
         }
     });
 
+    $(document).on('change', '.scan-result [data-model]', function () {
+        $(this).addClass('chosen');
+    });
+
     $(document).on('click', 'tr[data-toggle-checkbox]', function (e) {
         if ($(e.target).is('td')) {
             var control = $(this);
@@ -67,34 +99,229 @@ App.prototype.bind = function () {
     });
 
     self.bindProfilesMode();
+    self.bindCharts();
+    self.resync();
 };
 
 App.prototype.update = function (data) {
     var self = this;
     var payload = JSON.parse(data);
-    if (payload.hasOwnProperty('battery_info')) {
-        payload = payload.battery_info;
-        var table = $('.status-table');
-        var nth = payload.slot + 2;
-        table.find('[data-led] td:nth-child(' + nth + ') .led').attr('class', 'led ' + payload.led);
-        table.find('[data-type] td:nth-child(' + nth + ')').text(payload.type);
-        table.find('[data-mode] td:nth-child(' + nth + ')').text(payload.mode);
-        table.find('[data-status] td:nth-child(' + nth + ')').text(payload.status);
-        table.find('[data-voltage] td:nth-child(' + nth + ')').text(payload.voltage + ' V');
-        table.find('[data-current] td:nth-child(' + nth + ')').text(payload.current + ' A');
-        table.find('[data-capacity] td:nth-child(' + nth + ')').text(payload.capacity + ' mAh');
-        table.find('[data-time] td:nth-child(' + nth + ')').text(payload.time);
-        table.find('[data-temperature] td:nth-child(' + nth + ')').text(payload.temperature + ' °C');
-        table.find('[data-resistance] td:nth-child(' + nth + ')').text(payload.resistance + ' mΩ');
-        table.find('tr').each(function () {
-            var row = $(this);
-            row.find('td:nth-child(' + nth + ')').attr('class', payload.status.toLowerCase());
+    if (payload.hasOwnProperty('battery_infos')) {
+        for (var i = 0; i < payload.battery_infos.length; i++) {
+            self.updateBatteryInfo(payload.battery_infos[i]);
+        }
+    } else if (payload.hasOwnProperty('scan_device')) {
+        self.updateScanDevice(payload.scan_device);
+    } else if (payload.hasOwnProperty('scan_done')) {
+        var done = payload.scan_done;
+        if (done.error) {
+            $('.scan-status').text(done.error);
+        } else if (done.devices === 0) {
+            $('.scan-status').text('No device found, try again');
+        } else {
+            $('.scan-status').text('Done, ' + done.chargers + ' chargers found');
+        }
+    }
+};
+
+App.prototype.updateScanDevice = function (device) {
+    var container = $('.scan-result');
+    var row = container.children().filter(function () {
+        return $(this).attr('data-device') === device.address;
+    });
+    if (!row.length) {
+        row = $('<div>').attr('data-device', device.address);
+        $('<a href="#">').attr('data-address', device.address).appendTo(row);
+        $('<span class="rssi">').appendTo(row);
+        var models = container.attr('data-models');
+        if (models) {
+            // fleet mode, the model is chosen per charger, preselected from the advertised name
+            var select = $('<select class="model" data-model>').appendTo(row);
+            $.each(models.split(','), function (index, model) {
+                $('<option>').val(model).text(model.toUpperCase()).appendTo(select);
+            });
+        }
+        row.appendTo(container);
+    }
+    if (device.model) {
+        row.find('[data-model]:not(.chosen)').val(device.model);
+    }
+    row.toggleClass('other', !device.matched);
+    row.find('a').text(device.address + ' (' + (device.name || 'unknown') + ')');
+    row.find('.rssi').text(device.rssi + ' dBm');
+};
+
+App.prototype.updateBatteryInfo = function (payload) {
+    var self = this;
+    var key = self.chartKey(payload.charger, payload.slot);
+    var info = self.slots[key];
+    if (!info) {
+        info = self.slots[key] = {};
+    }
+    $.extend(info, payload.changes);
+
+    var table = $('.status-table');
+    if (payload.charger !== null && payload.charger !== undefined) {
+        table = table.filter(function () {
+            return $(this).attr('data-charger') === payload.charger;
+        });
+    }
+    var nth = payload.slot + 2;
+    $.each(payload.changes, function (field, value) {
+        var suffix = App.FIELD_SUFFIXES[field];
+        if (field === 'led') {
+            table.find('[data-led] td:nth-child(' + nth + ') .led').attr('class', 'led ' + value);
+        } else if (field === 'status') {
+            table.find('[data-status] td:nth-child(' + nth + ')').text(value);
+            table.find('tr').each(function () {
+                var row = $(this);
+                row.find('td:nth-child(' + nth + ')').attr('class', value.toLowerCase());
+            });
+        } else if (suffix !== undefined) {
+            table.find('[data-' + field + '] td:nth-child(' + nth + ')').text(value + suffix);
+        }
+    });
+
+    self.appendChart(payload.charger, info, payload.timestamp);
+};
+
+App.prototype.resync = function () {
+    var self = this;
+    if (!$('.status-table').length) {
+        return;
+    }
+    $.getJSON('/state', function (payload) {
+        self.slots = {};
+        for (var i = 0; i < payload.battery_infos.length; i++) {
+            self.updateBatteryInfo(payload.battery_infos[i]);
+        }
+    });
+};
+
+App.prototype.chartKey = function (charger, slot) {
+    return (charger || '') + ':' + slot;
+};
+
+App.prototype.bindCharts = function () {
+    var self = this;
+    $('canvas[data-chart]').each(function () {
+        var canvas = $(this);
+        var chart = {
+            canvas: this,
+            charger: canvas.attr('data-charger'),
+            slot: canvas.attr('data-chart'),
+            series: null,
+            loaded: null,
+            last: null
+        };
+        self.charts[self.chartKey(chart.charger, chart.slot)] = chart;
+        self.loadChart(chart);
+    });
+};
+
+App.prototype.loadChart = function (chart) {
+    var self = this;
+    var url = '/series/' + chart.slot + '?points=' + App.CHART_POINTS;
+    if (chart.charger) {
+        url += '&charger=' + encodeURIComponent(chart.charger);
+    }
+    // once loaded, only samples recorded after the last loaded one are fetched
+    var since = null;
+    if (chart.series) {
+        since = chart.loaded !== null ? chart.loaded : chart.series.voltage[0][0] - 1;
+        url += '&since=' + since;
+    }
+    chart.loading = true;
+    $.getJSON(url, function (series) {
+        chart.loading = false;
+        var loaded = chart.series || {};
+        $.each(App.CHART_METRICS, function (metric) {
+            var points = series[metric] || [];
+            if (since !== null) {
+                // live points since the last load are replaced by the recorded ones
+                points = loaded[metric].filter(function (point) {
+                    return point[0] <= since;
+                }).concat(points);
+            }
+            loaded[metric] = points;
         });
-    } else if (payload.hasOwnProperty('scan_results')) {
-        $('.scan-result').html(payload.scan_results);
+        if (since !== null && loaded.voltage.length > App.CHART_POINTS * 2) {
+            // too many points, the whole span is loaded again - downsampled on the server, so the peaks stay
+            chart.series = null;
+            self.loadChart(chart);
+            return;
+        }
+        chart.series = loaded;
+        var voltage = chart.series.voltage;
+        if (voltage.length) {
+            chart.loaded = chart.last = voltage[voltage.length - 1][0];
+        }
+        self.drawChart(chart);
+    }).fail(function () {
+        chart.loading = false;
+    });
+};
+
+App.prototype.appendChart = function (charger, info, timestamp) {
+    var chart = this.charts[this.chartKey(charger, info.slot)];
+    if (!chart || !chart.series || chart.loading || info.status === 'Standby') {
+        return;
+    }
+    if (chart.last !== null && timestamp <= chart.last) {
+        return;
+    }
+    chart.last = timestamp;
+    $.each(App.CHART_METRICS, function (metric) {
+        chart.series[metric].push([timestamp, info[metric]]);
+    });
+    if (chart.series.voltage.length > App.CHART_POINTS * 2) {
+        // too many live points, replace them by the downsampled recorded ones
+        this.loadChart(chart);
+    } else {
+        this.drawChart(chart);
     }
 };
 
+App.prototype.drawChart = function (chart) {
+    var canvas = chart.canvas;
+    var context = canvas.getContext('2d');
+    var width = canvas.width;
+    var height = canvas.height;
+    context.clearRect(0, 0, width, height);
+
+    var points = chart.series.voltage;
+    if (points.length < 2) {
+        return;
+    }
+    var begin = points[0][0];
+    var span = points[points.length - 1][0] - begin || 1;
+
+    $.each(App.CHART_METRICS, function (metric, color) {
+        var series = chart.series[metric];
+        var minimum = Infinity;
+        var maximum = -Infinity;
+        for (var i = 0; i < series.length; i++) {
+            minimum = Math.min(minimum, series[i][1]);
+            maximum = Math.max(maximum, series[i][1]);
+        }
+        var range = maximum - minimum || 1;
+
+        context.beginPath();
+        context.strokeStyle = color;
+        context.lineWidth = 1;
+        for (var j = 0; j < series.length; j++) {
+            var x = (series[j][0] - begin) / span * (width - 2) + 1;
+            var y = height - 1 - (series[j][1] - minimum) / range * (height - 2);
+            if (j === 0) {
+                context.moveTo(x, y);
+            } else {
+                context.lineTo(x, y);
+            }
+        }
+        context.stroke();
+    });
+};
+
 App.prototype.bindProfilesMode = function () {
     var self = this;
     var wrapper = $('.wrapper.profiles-mode');
@@ -0,0 +1,278 @@
+"""
+Vectorized decoding of captured MC3000 `BATTERY_INFO` (0x55) and MC5000 `SLOT_STATUS` (0x91) frames.
+
+Raw frames are viewed (without copying) as a structured dtype matching the wire layout, checksums are validated
+and all columns are decoded in one pass over the whole array. Labels (type, mode, status, LED) are kept as small
+integer codes and resolved by `labels()` or `to_battery_info()` through precomputed lookup tables, results
+are identical to `parse_battery_info` of the scalar decoders.
+"""
+
+import numpy
+
+from mc3000ble import MC3000Ble
+from mc5000ble import MC5000Ble
+from telemetry import BatteryInfo
+
+MC3000_FRAME_SIZE = 20
+
+MC3000_WIRE = numpy.dtype([
+    ("header", "u1"),
+    ("command", "u1"),
+    ("slot", "u1"),
+    ("type", "u1"),
+    ("mode", "u1"),
+    ("count", "u1"),
+    ("status", "u1"),
+    ("time", ">u2"),
+    ("voltage", ">u2"),
+    ("current", ">u2"),
+    ("capacity", ">u2"),
+    ("temperature", "u1"),
+    ("resistance", ">u2"),
+    ("led", "u1"),
+    ("checksum", "u1"),
+])
+
+MC5000_WIRE_FIELDS = [
+    ("header", "u1", 0),
+    ("length", "u1", 1),
+    ("command", "u1", 2),
+    ("channel", "u1", 3),
+    ("current", ">u2", 4),
+    ("voltage", ">u2", 6),
+    ("temperature", ">u2", 8),
+    ("capacity", ">u2", 10),
+    ("time", ">u4", 12),
+    ("resistance", ">u2", 16),
+    ("status", "u1", 18),
+    ("mode", "u1", 19),
+    ("error", "u1", 20),
+    ("type", "u1", 21),
+]
+
+# resistance of "n/a" readings is stored as -1
+NO_RESISTANCE = -1
+
+LED_NONE = 0
+LED_RED = 1
+LED_GREEN = 2
+LED_LABELS = numpy.array(["none", "red", "green"], dtype=object)
+
+DECODED = numpy.dtype([
+    ("valid", "?"),
+    ("slot", "i1"),
+    ("type", "u1"),
+    ("mode", "u1"),
+    ("count", "i2"),
+    ("status", "u1"),
+    ("error", "u1"),
+    ("time", "u4"),
+    ("voltage", "f8"),
+    ("current", "f8"),
+    ("capacity", "u2"),
+    ("temperature", "f8"),
+    ("resistance", "i4"),
+    ("led", "u1"),
+])
+
+
+def as_frame_array(frames, width=None):
+    """
+    Converts frames (2D uint8 array, list of bytes-like frames or one concatenated bytes-like buffer)
+    to a contiguous 2D uint8 array of shape (count, width).
+    """
+    if isinstance(frames, numpy.ndarray):
+        array = numpy.ascontiguousarray(frames, dtype=numpy.uint8)
+    elif isinstance(frames, (bytes, bytearray, memoryview)):
+        if width is None:
+            raise ValueError("frame width is required for a concatenated buffer")
+        array = numpy.frombuffer(frames, dtype=numpy.uint8)
+    else:
+        frames = list(frames)
+        if width is None:
+            width = len(frames[0]) if frames else 0
+        array = numpy.frombuffer(b"".join(bytes(frame) for frame in frames), dtype=numpy.uint8)
+
+    if array.ndim == 1:
+        if width is None or width == 0 or array.size % width != 0:
+            raise ValueError("buffer of %s bytes can't be split into frames of %s bytes" % (array.size, width))
+        array = array.reshape(-1, width)
+    return array
+
+
+def build_label_table(labels, fallback):
+    table = numpy.full(256, fallback, dtype=object)
+    for index, label in labels.items():
+        table[index] = label
+    return table
+
+
+def build_mode_table(mode_labels, fallback):
+    table = numpy.full((256, 256), fallback, dtype=object)
+    for battery_type, modes in mode_labels.items():
+        for mode, label in modes.items():
+            table[battery_type, mode] = label
+    return table
+
+
+class MC3000BatchDecoder:
+    type_labels = build_label_table(MC3000Ble.types, "unknown")
+    mode_labels = build_mode_table(MC3000Ble.mode_labels, "unknown")
+    status_labels = build_label_table(MC3000Ble.statuses, "unknown error")
+
+    def decode(self, frames):
+        array = as_frame_array(frames, MC3000_FRAME_SIZE)
+        if array.shape[1] != MC3000_FRAME_SIZE:
+            raise ValueError("MC3000 frames have to be %s bytes, got %s" % (MC3000_FRAME_SIZE, array.shape[1]))
+        wire = array.view(MC3000_WIRE)[:, 0]
+
+        decoded = numpy.empty(len(wire), dtype=DECODED)
+        checksum = (array[:, :-1].sum(axis=1, dtype=numpy.uint32) & 0xFF).astype(numpy.uint8)
+        decoded["valid"] = (checksum == wire["checksum"]) & (wire["command"] == MC3000Ble.BATTERY_INFO)
+
+        slot = wire["slot"]
+        decoded["slot"] = slot
+        decoded["type"] = wire["type"]
+        decoded["mode"] = wire["mode"]
+        decoded["count"] = wire["count"]
+        decoded["status"] = wire["status"]
+        decoded["error"] = 0
+        decoded["time"] = wire["time"]
+        decoded["voltage"] = wire["voltage"] / 1000
+        decoded["current"] = wire["current"] / 1000
+        decoded["capacity"] = wire["capacity"]
+        decoded["temperature"] = wire["temperature"]
+        decoded["resistance"] = resolve_resistance(wire["resistance"])
+
+        led = wire["led"].astype(numpy.uint16)
+        shift = slot.astype(numpy.uint16)
+        red = (led >> shift) & 1
+        green = (led >> (shift + 4)) & 1
+        decoded["led"] = numpy.where(red == 1, LED_RED, numpy.where(green == 1, LED_GREEN, LED_NONE))
+
+        return decoded
+
+    def labels(self, decoded):
+        return {
+            "type": self.type_labels[decoded["type"]],
+            "mode": self.mode_labels[decoded["type"], decoded["mode"]],
+            "status": self.status_labels[decoded["status"]],
+            "led": LED_LABELS[decoded["led"]],
+        }
+
+    def to_battery_info(self, decoded):
+        labels = self.labels(decoded)
+        records = []
+        for index, row in enumerate(decoded.tolist()):
+            records.append(BatteryInfo(
+                row[1],
+                labels["type"][index],
+                labels["mode"][index],
+                row[4],
+                labels["status"][index],
+                None,
+                row[7],
+                row[8],
+                row[9],
+                row[10],
+                int(row[11]),
+                "n/a" if row[12] == NO_RESISTANCE else row[12],
+                labels["led"][index],
+            ))
+        return records
+
+
+class MC5000BatchDecoder:
+    """
+    The MC5000 reply doesn't carry the slot index directly - it's resolved from the channel bitmask
+    (1, 2, 4, 8), frames with any other channel value get slot -1 and are marked as invalid.
+    """
+
+    type_labels = build_label_table(MC5000Ble.types, "unknown")
+    mode_labels = build_mode_table(MC5000Ble.mode_labels, "unknown")
+    status_labels = build_label_table(MC5000Ble.statuses, "unknown")
+    error_labels = build_label_table(MC5000Ble.errors, "ERROR")
+
+    channel_slots = numpy.full(256, -1, dtype=numpy.int8)
+    channel_slots[[1, 2, 4, 8]] = [0, 1, 2, 3]
+
+    def decode(self, frames):
+        array = as_frame_array(frames)
+        width = array.shape[1]
+        if width < 23:
+            raise ValueError("MC5000 frames have to be at least 23 bytes, got %s" % width)
+        names, formats, offsets = zip(*MC5000_WIRE_FIELDS)
+        wire_dtype = numpy.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": width})
+        wire = array.view(wire_dtype)[:, 0]
+
+        decoded = numpy.empty(len(wire), dtype=DECODED)
+        checksum = (array[:, 2:-1].sum(axis=1, dtype=numpy.uint32) & 0xFF).astype(numpy.uint8)
+        slot = self.channel_slots[wire["channel"]]
+        decoded["valid"] = (checksum == array[:, -1]) & (wire["command"] == MC5000Ble.SLOT_STATUS) & (slot >= 0)
+
+        status = wire["status"]
+        decoded["slot"] = slot
+        decoded["type"] = wire["type"]
+        decoded["mode"] = wire["mode"]
+        decoded["count"] = -1
+        decoded["status"] = status
+        decoded["error"] = wire["error"]
+        decoded["time"] = wire["time"]
+        decoded["voltage"] = wire["voltage"] / 1000
+        decoded["current"] = wire["current"] / 1000
+        decoded["capacity"] = wire["capacity"]
+        temperature = wire["temperature"] / 1000
+        temperature[temperature < 1] = 0
+        decoded["temperature"] = temperature
+        decoded["resistance"] = resolve_resistance(wire["resistance"])
+        decoded["led"] = numpy.where(status == 0, LED_NONE, numpy.where(status <= 4, LED_RED, LED_GREEN))
+
+        return decoded
+
+    def labels(self, decoded):
+        error = decoded["error"]
+        error_labels = self.error_labels[error]
+        return {
+            "type": self.type_labels[decoded["type"]],
+            "mode": self.mode_labels[decoded["type"], decoded["mode"]],
+            "status": numpy.where(error > 0, error_labels, self.status_labels[decoded["status"]]),
+            "error": error_labels,
+            "led": LED_LABELS[decoded["led"]],
+        }
+
+    def to_battery_info(self, decoded):
+        labels = self.labels(decoded)
+        records = []
+        for index, row in enumerate(decoded.tolist()):
+            records.append(BatteryInfo(
+                row[1],
+                labels["type"][index],
+                labels["mode"][index],
+                None,
+                labels["status"][index],
+                labels["error"][index],
+                row[7],
+                row[8],
+                row[9],
+                row[10],
+                row[11] if row[11] != 0 else 0,
+                "n/a" if row[12] == NO_RESISTANCE else row[12],
+                labels["led"][index],
+            ))
+        return records
+
+
+def resolve_resistance(resistance):
+    resolved = resistance.astype(numpy.int32)
+    resolved[(resistance == 0) | (resistance == 1) | (resistance == 65535)] = NO_RESISTANCE
+    return resolved
+
+
+decoders = {
+    "mc3000": MC3000BatchDecoder,
+    "mc5000": MC5000BatchDecoder,
+}
+
+
+def decode(model, frames):
+    return decoders[model]().decode(frames)
@@ -0,0 +1,102 @@
+"""
+Adaptive polling cadence of charger slots.
+
+Every slot has its own next poll time derived from its last reported state - active slots (charging,
+discharging, ...) are polled fast, idle slots (a battery that is done or waits in Standby) slowly and empty slots
+rarely. Right after a status change the slot is polled in a burst, so the transition is captured in detail.
+Slots that didn't report yet are polled at the base interval.
+"""
+
+from time import monotonic
+
+from sessions import ACTIVE_STATUSES
+
+# voltage (V) below which a slot in Standby is considered empty
+EMPTY_VOLTAGE = 0.2
+
+
+class PollScheduler:
+    ACTIVE = "active"
+    IDLE = "idle"
+    EMPTY = "empty"
+    BURST = "burst"
+
+    def __init__(self, interval=1, slots=4, active_interval=None, idle_interval=5, empty_interval=15,
+                 burst_interval=None, burst_duration=5):
+        """
+        `interval` is the base cadence, active slots default to half of it and bursts to a quarter.
+        """
+        self.intervals = {
+            self.ACTIVE: active_interval if active_interval is not None else interval / 2,
+            self.IDLE: idle_interval,
+            self.EMPTY: empty_interval,
+            self.BURST: burst_interval if burst_interval is not None else interval / 4,
+            # no reply yet
+            None: interval,
+        }
+        self.burst_duration = burst_duration
+        self.slots = list(range(slots))
+        self.states = [None] * slots
+        self.statuses = [None] * slots
+        self.burst_until = [0] * slots
+        self.next_poll = [0] * slots
+
+    @classmethod
+    def from_config(cls, interval, section, slots=4):
+        section = section or {}
+        return cls(
+            interval,
+            slots,
+            active_interval=section.get("active"),
+            idle_interval=section.get("idle", 5),
+            empty_interval=section.get("empty", 15),
+            burst_interval=section.get("burst"),
+            burst_duration=section.get("burst_duration", 5),
+        )
+
+    def observe(self, battery_info, now=None):
+        slot = battery_info.slot
+        if slot is None or slot >= len(self.states):
+            return
+        if now is None:
+            now = monotonic()
+
+        status = battery_info.status
+        if status in ACTIVE_STATUSES:
+            state = self.ACTIVE
+        elif status == "Standby" and battery_info.voltage < EMPTY_VOLTAGE:
+            state = self.EMPTY
+        else:
+            state = self.IDLE
+
+        previous = self.statuses[slot]
+        if previous is not None and previous != status:
+            self.burst_until[slot] = now + self.burst_duration
+        self.statuses[slot] = status
+        self.states[slot] = state
+
+    def get_interval(self, slot, now):
+        if now < self.burst_until[slot]:
+            return self.intervals[self.BURST]
+        return self.intervals[self.states[slot]]
+
+    def due(self, now=None):
+        """
+        Slots to poll now, in slot order.
+        """
+        if now is None:
+            now = monotonic()
+        return [slot for slot in self.slots if self.next_poll[slot] <= now]
+
+    def polled(self, slot, now=None):
+        if now is None:
+            now = monotonic()
+        self.next_poll[slot] = now + self.get_interval(slot, now)
+
+    def wait(self, now=None):
+        """
+        Seconds until the next slot is due.
+        """
+        if now is None:
+            now = monotonic()
+        return max(min(self.next_poll) - now, 0)
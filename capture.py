@@ -0,0 +1,188 @@
+"""
+Compact binary capture of raw BLE notifications.
+
+File starts with a header (magic, version, charger model, capture start as unix time) followed by records
+of (milliseconds since start as uint32, payload length as uint8, payload). A typical 20 byte MC3000
+notification takes 25 bytes on disk.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import struct
+from time import monotonic, time
+
+import pendulum
+
+import config
+from mc3000ble import MC3000Ble
+from mc5000ble import MC5000Ble
+
+MAGIC = b"MCCAP"
+VERSION = 1
+HEADER = struct.Struct("<5sB8sd")
+RECORD = struct.Struct("<IB")
+
+
+def get_capture_dir():
+    return os.path.join(config.data_dir, "captures")
+
+
+def create_capture_path(model):
+    directory = get_capture_dir()
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, "%s-%s.cap" % (model, pendulum.now().format("YYYYMMDD-HHmmss")))
+
+
+class CaptureWriter:
+    def __init__(self, path, model, flush_every=64):
+        self.path = path
+        self.model = model
+        self.flush_every = flush_every
+        # wall-clock start is only stored in the header, offsets are measured on the monotonic clock
+        # so a clock adjustment during the capture can't make them negative
+        self.started = time()
+        self.begin = monotonic()
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, model.encode("ascii"), self.started))
+
+    def write(self, data, offset=None):
+        """
+        `offset` is the time of the frame in seconds since the capture start, current time by default.
+        """
+        if self.file is None:
+            return
+        if offset is None:
+            offset = monotonic() - self.begin
+        self.file.write(RECORD.pack(int(offset * 1000), len(data)))
+        self.file.write(data)
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            magic, version, model, started = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise CaptureException("'%s' is not a capture file" % path)
+        if version != VERSION:
+            raise CaptureException("unsupported capture version %s" % version)
+        self.model = model.rstrip(b"\x00").decode("ascii")
+        self.started = started
+
+    def __iter__(self):
+        """
+        Yields (seconds since capture start, payload) tuples.
+        """
+        with open(self.path, "rb") as file:
+            file.seek(HEADER.size)
+            while True:
+                record = file.read(RECORD.size)
+                if len(record) < RECORD.size:
+                    break
+                offset, length = RECORD.unpack(record)
+                data = file.read(length)
+                if len(data) < length:
+                    break
+                yield offset / 1000, bytearray(data)
+
+
+class Replay:
+    """
+    Feeds a capture back through `_async_callback` of given service, so the whole pipeline from checksum check
+    to the receive callback runs exactly as with a charger.
+
+    Has the same `run`/`run_async`/`stop` interface as the BLE services and can be used in their place.
+    Speed 1 replays in real time, N replays N times faster and 0 as fast as possible.
+    Frames further apart than `SWEEP_GAP` seconds of capture time are separate polling rounds,
+    the `sweep_callback` of the service is called after each.
+    """
+
+    SWEEP_GAP = 0.1
+
+    def __init__(self, service, path, speed=1):
+        self.service = service
+        self.reader = CaptureReader(path)
+        self.speed = speed
+        self.running = False
+        self.count = 0
+        self.offset = 0
+
+    def run(self, receive_callback):
+        asyncio.run(self.run_async(receive_callback))
+
+    async def run_async(self, receive_callback):
+        logging.info("replay of %s started" % self.reader.path)
+        self.running = True
+        self.service.running = True
+        self.service.receive_callback = receive_callback
+        begin = monotonic()
+        previous = None
+        for offset, data in self.reader:
+            if not self.running:
+                break
+
+            if previous is not None and offset - previous > self.SWEEP_GAP:
+                self.service.sweep_callback()
+            previous = offset
+
+            if self.speed > 0:
+                delay = offset / self.speed - (monotonic() - begin)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            self.offset = offset
+            await self.service._async_callback(None, data)
+            self.count += 1
+
+        if previous is not None:
+            self.service.sweep_callback()
+        self.running = False
+        self.service.running = False
+        logging.info("replay of %s done, %s frames" % (self.reader.path, self.count))
+
+    def stop(self):
+        self.running = False
+        self.service.stop()
+
+
+class CaptureException(Exception):
+    pass
+
+
+def create_service(model, address="replay"):
+    if model == "mc5000":
+        return MC5000Ble(ble_address=address)
+    return MC3000Ble(ble_address=address)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="inspect and replay captures")
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=0)
+    parser.add_argument("--info", action="store_true", help="only print capture summary")
+    arguments = parser.parse_args()
+
+    reader = CaptureReader(arguments.path)
+    if arguments.info:
+        frames = list(reader)
+        duration = frames[-1][0] if frames else 0
+        print("model: %s" % reader.model)
+        print("started: %s" % pendulum.from_timestamp(reader.started).to_datetime_string())
+        print("frames: %s over %s s" % (len(frames), duration))
+    else:
+        try:
+            Replay(create_service(reader.model), arguments.path, arguments.speed).run(print)
+        except KeyboardInterrupt:
+            exit(1)
@@ -0,0 +1,186 @@
+"""
+Connection watchdog of a BLE service.
+
+The service runs as a task that is cancelled as soon as the BLE stack reports a disconnect (`disconnected_callback`
+of the current client, late callbacks of earlier clients are ignored) or no frame arrived within `stall_timeout`.
+Reconnects are retried with jittered exponential backoff, the first one right away, and reuse the `BLEDevice` found
+by the first scan, so a reconnect doesn't pay for another scan. Time from losing the connection to the first frame
+after reconnect is exported as metrics.
+"""
+
+import asyncio
+import logging
+import random
+from time import monotonic
+
+import bleak
+from bleak import BleakScanner
+
+
+class Watchdog:
+    BACKOFF_MIN = 0.25
+    BACKOFF_MAX = 30
+    BACKOFF_FACTOR = 2
+
+    # no frame within this many seconds of a connected service is handled as a disconnect
+    STALL_TIMEOUT = 10
+
+    SCAN_TIMEOUT = 10
+
+    # after this many failed attempts in a row the cached device is dropped and scanned for again
+    RESCAN_AFTER = 5
+
+    def __init__(self, service, name=None, connection_callback=None, resolve_device=True, known=False):
+        """
+        `connection_callback(connected, name)` is called when the first frame arrives after (re)connect
+        and when the connection is lost. Address of a `known` charger is connected directly, the discovery
+        runs only after repeated failures.
+        """
+        self.service = service
+        self.name = name
+        self.connection_callback = connection_callback
+        self.resolve_device = resolve_device
+        self.known = known
+        self.metrics = service.metrics
+        self.running = False
+        self.connected = False
+        self.failures = 0
+        self.lost = None
+        self.last_frame = None
+        self.disconnected = None
+        self.wakeup = None
+        self.loop = None
+
+    def run(self, receive_callback):
+        asyncio.run(self.run_async(receive_callback))
+
+    async def run_async(self, receive_callback):
+        self.running = True
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.service.disconnected_callback = self._disconnected
+
+        def callback(*arguments):
+            self.last_frame = monotonic()
+            if not self.connected:
+                self._connected()
+            receive_callback(*arguments)
+
+        while self.running:
+            self.disconnected = asyncio.Event()
+            # a late disconnect of the previous client must not end the new connection
+            self.service.client = None
+            try:
+                if self.resolve_device and self.service.device is None and (
+                        not self.known or self.failures >= self.RESCAN_AFTER):
+                    await self._find_device()
+                await self._run_service(callback)
+            except (bleak.BleakError, asyncio.TimeoutError, OSError) as e:
+                logging.warning("%s failed: %s" % (self.get_label(), e))
+            finally:
+                self.service.running = False
+
+            if not self.running:
+                break
+
+            self._lost()
+            self.failures += 1
+            self.metrics.reconnects.inc()
+            if self.failures >= self.RESCAN_AFTER and self.resolve_device:
+                self.service.device = None
+            await self._backoff()
+
+        self.metrics.connected.set(0)
+
+    async def _find_device(self):
+        device = await BleakScanner.find_device_by_address(self.service.ble_address, timeout=self.SCAN_TIMEOUT)
+        if device is None:
+            raise bleak.BleakError("device %s not found" % self.service.ble_address)
+        self.service.device = device
+
+    async def _run_service(self, callback):
+        self.last_frame = monotonic()
+        service_task = asyncio.ensure_future(self.service.run_async(callback))
+        disconnected_task = asyncio.ensure_future(self.disconnected.wait())
+        stall_task = asyncio.ensure_future(self._watch_stall())
+        try:
+            await asyncio.wait([service_task, disconnected_task, stall_task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (disconnected_task, stall_task):
+                task.cancel()
+            if not service_task.done():
+                service_task.cancel()
+                try:
+                    await service_task
+                except (asyncio.CancelledError, asyncio.TimeoutError, bleak.BleakError, OSError):
+                    pass
+        if service_task.done() and not service_task.cancelled():
+            # propagates connect errors
+            service_task.result()
+
+    async def _watch_stall(self):
+        """
+        Sleeps until the last frame gets older than the stall timeout, no periodic wakeups.
+        """
+        timeout = max(self.STALL_TIMEOUT, float(self.service.interval) * 3)
+        while True:
+            remaining = self.last_frame + timeout - monotonic()
+            if remaining <= 0:
+                logging.warning("%s sent no frames for %s s" % (self.get_label(), timeout))
+                return
+            await asyncio.sleep(remaining)
+
+    async def _backoff(self):
+        delay = 0
+        if self.failures > 1:
+            delay = min(self.BACKOFF_MIN * self.BACKOFF_FACTOR ** (self.failures - 2), self.BACKOFF_MAX)
+            delay = random.uniform(delay / 2, delay)
+        logging.info("reconnecting %s in %.2f s (attempt %s)" % (self.get_label(), delay, self.failures))
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _disconnected(self, client):
+        if client is not self.service.client:
+            logging.debug("%s: ignoring disconnect of a previous client" % self.get_label())
+            return
+        if self.running and self.disconnected is not None:
+            logging.warning("%s disconnected" % self.get_label())
+            self.disconnected.set()
+
+    def _connected(self):
+        self.connected = True
+        self.failures = 0
+        self.metrics.connected.set(1)
+        if self.lost is not None:
+            elapsed = monotonic() - self.lost
+            self.metrics.reconnect_seconds.inc(elapsed)
+            self.metrics.last_reconnect_seconds.set(elapsed)
+            logging.info("%s reconnected in %.2f s" % (self.get_label(), elapsed))
+            self.lost = None
+        if self.connection_callback is not None:
+            self.connection_callback(True, self.name)
+
+    def _lost(self):
+        if self.connected:
+            self.connected = False
+            self.lost = monotonic()
+            self.metrics.disconnects.inc()
+            self.metrics.connected.set(0)
+            if self.connection_callback is not None:
+                self.connection_callback(False, self.name)
+
+    def get_label(self):
+        if self.name is not None:
+            return "charger %s (%s)" % (self.name, self.service.ble_address)
+        return "charger %s" % self.service.ble_address
+
+    def stop(self):
+        """
+        Can be called from any thread.
+        """
+        self.running = False
+        self.service.stop()
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
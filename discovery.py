@@ -0,0 +1,125 @@
+"""
+Streaming discovery of chargers.
+
+Advertisements are handled as they arrive (detection callback), so every matching device is reported as soon
+as it's seen and its RSSI is updated live, instead of waiting for the whole scan to finish.
+"""
+
+import asyncio
+import logging
+
+from bleak import BleakScanner
+
+# advertised names of chargers, matched case-insensitively as substrings
+CHARGER_NAMES = ("MC3000", "MC5000", "MC-3000", "MC-5000", "SkyRC")
+
+# advertised name fragments telling the charger model, matched case-insensitively
+MODEL_NAMES = {
+    "mc3000": ("MC3000", "MC-3000"),
+    "mc5000": ("MC5000", "MC-5000"),
+}
+
+# RSSI changes smaller than this many dBm aren't reported again
+RSSI_STEP = 3
+
+
+def infer_model(name):
+    """
+    Charger model ("mc3000" or "mc5000") from the advertised name, None when the name doesn't tell.
+    """
+    if not name:
+        return None
+    name = name.upper()
+    for model, fragments in MODEL_NAMES.items():
+        for fragment in fragments:
+            if fragment in name:
+                return model
+    return None
+
+
+class ScanResult:
+    def __init__(self, device, name, rssi, matched):
+        self.device = device
+        self.name = name
+        self.rssi = rssi
+        self.matched = matched
+
+    def to_dict(self):
+        return {
+            "address": self.device.address,
+            "name": self.name,
+            "rssi": self.rssi,
+            "matched": self.matched,
+            "model": infer_model(self.name),
+        }
+
+
+class ChargerScanner:
+    """
+    Devices advertising `service_uuid` or with a name matching `names` are chargers, other devices are reported
+    only with `show_all`. `device_callback(result)` is called when a device is seen for the first time
+    and when its name or RSSI changes. With `stop_on_match` the scan ends at the first charger found.
+    """
+
+    def __init__(self, service_uuid, names=CHARGER_NAMES, show_all=False, stop_on_match=False, timeout=10,
+                 device_callback=None):
+        self.service_uuid = service_uuid.lower()
+        self.names = [name.lower() for name in names]
+        self.show_all = show_all
+        self.stop_on_match = stop_on_match
+        self.timeout = timeout
+        self.device_callback = device_callback
+        self.results = {}
+        self.found = None
+
+    async def run(self):
+        """
+        Returns {address: ScanResult} of reported devices.
+        """
+        self.found = asyncio.Event()
+        scanner = BleakScanner(detection_callback=self._detected)
+        logging.info("scanning started")
+        await scanner.start()
+        try:
+            await asyncio.wait_for(self.found.wait(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await scanner.stop()
+        logging.info("scanning done, %s devices" % len(self.results))
+        return self.results
+
+    def is_charger(self, name, service_uuids):
+        if self.service_uuid in (uuid.lower() for uuid in service_uuids):
+            return True
+        if name:
+            name = name.lower()
+            for pattern in self.names:
+                if pattern in name:
+                    return True
+        return False
+
+    def _detected(self, device, advertisement_data):
+        name = advertisement_data.local_name or device.name
+        rssi = advertisement_data.rssi
+        result = self.results.get(device.address)
+        if result is None:
+            matched = self.is_charger(name, advertisement_data.service_uuids)
+            if not matched and not self.show_all:
+                return
+            result = self.results[device.address] = ScanResult(device, name, rssi, matched)
+        else:
+            changed = (name and name != result.name) or abs(rssi - result.rssi) >= RSSI_STEP
+            result.device = device
+            if name:
+                result.name = name
+            if not changed:
+                return
+            result.rssi = rssi
+            if not result.matched:
+                result.matched = self.is_charger(result.name, advertisement_data.service_uuids)
+
+        if self.device_callback is not None:
+            self.device_callback(result)
+        if result.matched and self.stop_on_match:
+            self.found.set()
@@ -0,0 +1,271 @@
+"""
+Streaming estimate of time to completion of every active slot.
+
+Every slot keeps only the previous frame and exponentially smoothed rates, so an update is O(1) and no history
+is stored. Charging of lithium chemistries is modeled as CC followed by CV - in CC the remaining time
+is the voltage approach to the charge end voltage plus the expected CV tail, in CV the current taper
+I(t) = I * e^(kt) is extrapolated to the charge end current. Other chemistries and discharging use
+the capacity slope against the target capacity (when known) or the voltage approach to the discharge cut voltage.
+
+Targets are the charger defaults per battery type and can be overridden by the `eta` section of the config.
+`python eta.py <capture>` replays a capture and reports the estimate error against the actual completion.
+"""
+
+import argparse
+import math
+from time import time
+
+# charge end voltage (V) of lithium chemistries, both MC3000 and MC5000 type labels
+CHARGE_END_VOLTAGES = {
+    "LiIon": 4.2,
+    "Li-ion": 4.2,
+    "LiIo4_35": 4.35,
+    "Li-ion HV": 4.35,
+    "LiFe": 3.6,
+    "LiFePO4": 3.6,
+    "Batlto": 2.85,
+    "LTO": 2.85,
+    "Na-ion": 4.0,
+}
+
+DISCHARGE_CUT_VOLTAGES = {
+    "LiIon": 2.8,
+    "Li-ion": 2.8,
+    "LiIo4_35": 2.8,
+    "Li-ion HV": 2.8,
+    "LiFe": 2.5,
+    "LiFePO4": 2.5,
+    "Batlto": 1.8,
+    "LTO": 1.8,
+    "Na-ion": 2.0,
+    "NiMH": 1.0,
+    "NiCd": 1.0,
+    "Eneloop": 1.0,
+    "NiZn": 1.2,
+    "Ram": 1.0,
+    "RAM": 1.0,
+}
+
+# charge end current (A) - the charger terminates CV when the current drops below it
+CHARGE_END_CURRENT = 0.1
+
+# voltage within this margin (V) of the charge end voltage means the charger is in CV
+CV_MARGIN = 0.01
+
+# time constant (s) of the CV current taper assumed until the taper is observed
+CV_TIME_CONSTANT = 1200
+
+# time constant (s) of rate smoothing, frames further apart than INTERVAL_MAX reset the rates
+SMOOTHING = 60
+INTERVAL_MAX = 60
+
+ETA_MAX = 48 * 3600
+
+
+class Targets:
+    def __init__(self, charge_end_voltages=None, discharge_cut_voltages=None, charge_end_current=CHARGE_END_CURRENT,
+                 capacities=None):
+        self.charge_end_voltages = dict(CHARGE_END_VOLTAGES)
+        self.charge_end_voltages.update(charge_end_voltages or {})
+        self.discharge_cut_voltages = dict(DISCHARGE_CUT_VOLTAGES)
+        self.discharge_cut_voltages.update(discharge_cut_voltages or {})
+        self.charge_end_current = charge_end_current
+        # target capacity (mAh) per battery type, enables the capacity slope model
+        self.capacities = capacities or {}
+
+    @classmethod
+    def from_config(cls, section):
+        section = section or {}
+        return cls(
+            section.get("charge_end_voltage"),
+            section.get("discharge_cut_voltage"),
+            section.get("charge_end_current", CHARGE_END_CURRENT),
+            section.get("capacity"),
+        )
+
+
+class SlotEstimator:
+    __slots__ = (
+        "status", "timestamp", "voltage", "current", "capacity", "voltage_rate", "capacity_rate", "current_decay",
+    )
+
+    def __init__(self):
+        self.reset(None)
+
+    def reset(self, status):
+        self.status = status
+        self.timestamp = None
+        self.voltage = None
+        self.current = None
+        self.capacity = None
+        self.voltage_rate = None
+        self.capacity_rate = None
+        self.current_decay = None
+
+    def update(self, timestamp, battery_info, targets):
+        """
+        Seconds to completion or None when unknown.
+        """
+        status = battery_info.status
+        if status != self.status:
+            self.reset(status)
+
+        voltage = battery_info.voltage
+        current = battery_info.current
+        capacity = battery_info.capacity
+        if self.timestamp is not None:
+            elapsed = timestamp - self.timestamp
+            if elapsed > INTERVAL_MAX:
+                self.voltage_rate = self.capacity_rate = self.current_decay = None
+            elif elapsed > 0:
+                weight = 1 - math.exp(-elapsed / SMOOTHING)
+                self.voltage_rate = smooth(self.voltage_rate, (voltage - self.voltage) / elapsed, weight)
+                self.capacity_rate = smooth(self.capacity_rate, (capacity - self.capacity) / elapsed, weight)
+                if current > 0 and self.current > 0:
+                    decay = (math.log(current) - math.log(self.current)) / elapsed
+                    self.current_decay = smooth(self.current_decay, decay, weight)
+            else:
+                return None
+        self.timestamp = timestamp
+        self.voltage = voltage
+        self.current = current
+        self.capacity = capacity
+
+        if status == "Charging":
+            eta = self.estimate_charge(battery_info.type, targets)
+        elif status == "Discharging":
+            eta = self.estimate_discharge(battery_info.type, targets)
+        else:
+            eta = None
+
+        if eta is None or eta < 0 or eta > ETA_MAX:
+            return None
+        return eta
+
+    def estimate_charge(self, battery_type, targets):
+        end_voltage = targets.charge_end_voltages.get(battery_type)
+        if end_voltage is None:
+            return self.estimate_capacity(battery_type, targets)
+
+        end_current = targets.charge_end_current
+        if self.current <= end_current:
+            return 0
+        if self.voltage >= end_voltage - CV_MARGIN:
+            if self.current_decay is None or self.current_decay >= 0:
+                # right after the switch to CV the taper isn't observed yet
+                return CV_TIME_CONSTANT * math.log(self.current / end_current)
+            return math.log(end_current / self.current) / self.current_decay
+
+        if self.voltage_rate is None or self.voltage_rate <= 0:
+            return None
+        constant_current = (end_voltage - self.voltage) / self.voltage_rate
+        return constant_current + CV_TIME_CONSTANT * math.log(self.current / end_current)
+
+    def estimate_discharge(self, battery_type, targets):
+        eta = self.estimate_capacity(battery_type, targets)
+        if eta is not None:
+            return eta
+        cut_voltage = targets.discharge_cut_voltages.get(battery_type)
+        if cut_voltage is None or self.voltage_rate is None or self.voltage_rate >= 0:
+            return None
+        return (self.voltage - cut_voltage) / -self.voltage_rate
+
+    def estimate_capacity(self, battery_type, targets):
+        capacity = targets.capacities.get(battery_type)
+        if capacity is None or self.capacity_rate is None or self.capacity_rate <= 0:
+            return None
+        return (capacity - self.capacity) / self.capacity_rate
+
+
+def smooth(average, value, weight):
+    if average is None:
+        return value
+    return average + weight * (value - average)
+
+
+class EtaEstimator:
+    def __init__(self, targets=None):
+        self.targets = targets or Targets()
+        self.slots = {}
+
+    def update(self, battery_info, charger=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time()
+        key = (charger, battery_info.slot)
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = SlotEstimator()
+        return slot.update(timestamp, battery_info, self.targets)
+
+
+def evaluate(path, checkpoints=(0.25, 0.5, 0.75, 0.9), targets=None):
+    """
+    Replays a capture and compares estimates at given fractions of every finished charge/discharge
+    with the actual remaining time. Keeps the estimates of a phase in memory, which the estimator itself doesn't.
+
+    Returns a list of phases {"status", "slot", "duration", "checkpoints": [(fraction, estimate, actual), ...]},
+    times in seconds and the estimate None when there was none.
+    """
+    import capture
+
+    reader = capture.CaptureReader(path)
+    service = capture.create_service(reader.model)
+    replay = capture.Replay(service, path, speed=0)
+    estimator = EtaEstimator(targets)
+    phases = {}
+    finished_phases = []
+
+    def receive_callback(battery_info):
+        timestamp = reader.started + replay.offset
+        key = battery_info.slot
+        eta = estimator.update(battery_info, timestamp=timestamp)
+        phase = phases.get(key)
+        if phase is not None and phase[0] != battery_info.status:
+            if battery_info.status not in ("Charging", "Discharging", "Standby"):
+                finished_phases.append((phase[0], key, timestamp, phase[1]))
+            del phases[key]
+            phase = None
+        if phase is None and battery_info.status in ("Charging", "Discharging"):
+            phase = phases[key] = (battery_info.status, [])
+        if phase is not None:
+            phase[1].append((timestamp, eta))
+
+    replay.run(receive_callback)
+
+    results = []
+    for status, slot, finished, estimates in finished_phases:
+        started = estimates[0][0]
+        duration = finished - started
+        result = {
+            "status": status,
+            "slot": slot,
+            "duration": duration,
+            "checkpoints": [],
+        }
+        for checkpoint in checkpoints:
+            moment = started + duration * checkpoint
+            timestamp, eta = min(estimates, key=lambda estimate: abs(estimate[0] - moment))
+            result["checkpoints"].append((checkpoint, eta, finished - timestamp))
+        results.append(result)
+    return results
+
+
+def print_evaluation(results):
+    for result in results:
+        print("slot %s %s %.0f min" % (result["slot"] + 1, result["status"].lower(), result["duration"] / 60))
+        for checkpoint, eta, actual in result["checkpoints"]:
+            if eta is None:
+                print("  at %3.0f%%: no estimate, actual %.0f min" % (checkpoint * 100, actual / 60))
+            else:
+                print("  at %3.0f%%: estimate %.0f min, actual %.0f min, error %+.0f%%" % (
+                    checkpoint * 100, eta / 60, actual / 60, (eta - actual) / actual * 100 if actual else 0,
+                ))
+    if not results:
+        print("no finished charge or discharge in the capture")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="evaluate completion time estimates against a capture")
+    parser.add_argument("path")
+    arguments = parser.parse_args()
+    print_evaluation(evaluate(arguments.path))
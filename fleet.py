@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import sys
+
+from bleak import BleakClient
+
+from cadence import PollScheduler
+from connection import Watchdog
+from mc3000ble import MC3000Ble
+from mc5000ble import MC5000Ble
+
+
+class Charger:
+    """
+    Single charger section of the fleet configuration.
+
+    Configuration is a list under the `chargers` key, each item looks like:
+    {"name": "rack-1", "address": "AA:BB:CC:DD:EE:FF", "model": "mc3000", "interval": 1}
+    MC5000 sections may also set `in_flight` - the number of slot requests sent before their replies arrive.
+    """
+
+    models = {
+        "mc3000": MC3000Ble,
+        "mc5000": MC5000Ble,
+    }
+
+    def __init__(self, name, address, model="mc3000", interval=1, in_flight=1):
+        if model not in self.models:
+            raise ValueError("unknown charger model '%s'" % model)
+        self.name = name
+        self.address = address
+        self.model = model
+        self.interval = interval
+        self.in_flight = in_flight
+
+    @classmethod
+    def from_config(cls, section):
+        address = section["address"]
+        return cls(
+            name=section.get("name", address),
+            address=address,
+            model=section.get("model", "mc3000"),
+            interval=section.get("interval", 1),
+            in_flight=section.get("in_flight", 1),
+        )
+
+    def create_service(self, client_factory=BleakClient):
+        service_class = self.models[self.model]
+        if self.model == "mc5000":
+            return service_class(
+                ble_address=self.address, interval=self.interval, client_factory=client_factory,
+                in_flight=self.in_flight, name=self.name,
+            )
+        return service_class(
+            ble_address=self.address, interval=self.interval, client_factory=client_factory, name=self.name,
+        )
+
+
+class Fleet:
+    """
+    Monitors many chargers from one asyncio loop.
+
+    Every charger gets its own service object and BLE connection, but they all share the same loop and thread,
+    so each added charger costs only a service object, a connection and a handful of coroutines.
+    Receive callback is called as `receive_callback(battery_info, charger)` where `charger` is the charger name,
+    optional `connection_callback(connected, charger)` when a charger connects or loses the connection.
+    """
+
+    def __init__(self, chargers, client_factory=BleakClient, connection_callback=None, sweep_callback=None,
+                 polling=None, devices=None, known_addresses=()):
+        """
+        `sweep_callback(charger)` is called after every polling round of a charger, `polling` is the config section
+        of the polling cadence (see `cadence.PollScheduler.from_config`). `devices` are BLEDevice objects
+        by address from a previous scan, `known_addresses` are addresses known to be chargers - both skip
+        the discovery before the first connect.
+        """
+        self.chargers = chargers
+        self.client_factory = client_factory
+        self.connection_callback = connection_callback
+        self.sweep_callback = sweep_callback
+        self.polling = polling
+        self.devices = devices or {}
+        self.known_addresses = known_addresses
+        self.services = {}
+        self.watchdogs = {}
+        self.running = False
+
+    @classmethod
+    def from_config(cls, sections, client_factory=BleakClient, connection_callback=None, sweep_callback=None,
+                    polling=None, devices=None, known_addresses=()):
+        return cls(
+            [Charger.from_config(section) for section in sections],
+            client_factory=client_factory,
+            connection_callback=connection_callback,
+            sweep_callback=sweep_callback,
+            polling=polling,
+            devices=devices,
+            known_addresses=known_addresses,
+        )
+
+    def run(self, receive_callback):
+        asyncio.run(self.run_async(receive_callback))
+
+    async def run_async(self, receive_callback):
+        logging.info("fleet started with %s chargers" % len(self.chargers))
+        self.running = True
+        tasks = []
+        for charger in self.chargers:
+            service = charger.create_service(self.client_factory)
+            service.device = self.devices.get(charger.address)
+            service.scheduler = PollScheduler.from_config(charger.interval, self.polling)
+            self.services[charger.name] = service
+            tasks.append(self._supervise(charger, service, receive_callback))
+        await asyncio.gather(*tasks)
+
+    def stop(self):
+        self.running = False
+        for watchdog in self.watchdogs.values():
+            watchdog.stop()
+        logging.info("fleet stopped")
+
+    async def _supervise(self, charger, service, receive_callback):
+        def callback(battery_info):
+            receive_callback(battery_info, charger.name)
+
+        if self.sweep_callback is not None:
+            service.sweep_callback = lambda: self.sweep_callback(charger.name)
+
+        watchdog = Watchdog(
+            service, charger.name, self.connection_callback, resolve_device=self.client_factory is BleakClient,
+            known=charger.address in self.known_addresses,
+        )
+        self.watchdogs[charger.name] = watchdog
+        await watchdog.run_async(callback)
+
+
+class FleetState:
+    """
+    Combined state model of the fleet - the latest `BatteryInfo` record of every slot of every charger.
+    """
+
+    def __init__(self):
+        self.chargers = {}
+
+    def update(self, battery_info, charger):
+        slots = self.chargers.get(charger)
+        if slots is None:
+            slots = self.chargers[charger] = {}
+        slots[battery_info.slot] = battery_info
+
+    def get(self, charger, slot):
+        return self.chargers.get(charger, {}).get(slot)
+
+    def snapshot(self):
+        return {charger: dict(slots) for charger, slots in self.chargers.items()}
+
+
+class DebugPrint:
+    def __init__(self, sections):
+        self.state = FleetState()
+        self.fleet = Fleet.from_config(sections)
+
+    def run(self):
+        self.fleet.run(self.receive_callback)
+
+    def receive_callback(self, battery_info, charger):
+        self.state.update(battery_info, charger)
+        print(charger, battery_info)
+
+
+if __name__ == "__main__":
+    # usage: fleet.py mc3000=AA:BB:CC:DD:EE:FF mc5000=11:22:33:44:55:66 ...
+    try:
+        chargers = []
+        for argument in sys.argv[1:]:
+            model, address = argument.split("=", 1)
+            chargers.append({"address": address, "model": model})
+        DebugPrint(chargers).run()
+    except KeyboardInterrupt:
+        exit(1)
@@ -3,49 +3,100 @@ from http.client import HTTPConnection
 import json
 import logging
 import os
+import queue
 import socket
 import sys
-from time import sleep, time
+import threading
+from time import monotonic, sleep, time
 
 import bleak
 import flask
 from flask import render_template, Flask, jsonify, request, redirect, url_for
-from notifypy import Notify
 from ntdrt.threads import SafeThread
 import pendulum
-from screeninfo import screeninfo
-import webview
 
+from cadence import PollScheduler
+from capture import CaptureReader, CaptureWriter, Replay, create_capture_path, create_service
 import config
 from config import project_dir
+from connection import Watchdog
+from discovery import CHARGER_NAMES, ChargerScanner, infer_model
+from eta import EtaEstimator, Targets
+from fleet import Charger, Fleet, FleetState
+import mc3000ble
 from mc3000ble import MC3000Ble
+import mc5000ble
 from mc5000ble import MC5000Ble
-from profiles import ProfilesController
+import metrics
+from perf import PERF
+from runtime import Runtime
+from sessionlog import SessionLog
+from sessions import SessionTracker
+from stream import Broadcaster, encode_event
+from timeseries import TimeSeriesStore
+
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
 
 
 class Server:
     address = None
     separator = True
-    service_thread = None
+    service_future = None
     service = None
-    timeout_thread = None
     last_update_time = None
     waiting = True
-    scan_thread = None
-    loop = None
+    scan_future = None
     previous = {}
     variables = {}
     window = None
-
-    def __init__(self, app_name, profiles_mode=False, mc5000_mode=False):
+    series = None
+    session_log = None
+    push_timer = None
+    last_push = 0
+
+    def __init__(self, app_name, profiles_mode=False, mc5000_mode=False, fleet_mode=False, replay=None,
+                 replay_speed=1, headless=False, client_factory=bleak.BleakClient):
+        """
+        In headless mode GUI dependencies (pywebview, notify-py, screeninfo) are never imported,
+        only the BLE service and the HTTP server run. `client_factory` replaces `BleakClient`,
+        e.g. by `simulator.Simulator.create_client`.
+        """
         self.app_name = app_name
         self.title = app_name
         self.profiles_mode = profiles_mode
         self.mc5000_mode = mc5000_mode
-
-        config_name = "config-mc5000.json" if mc5000_mode else "config.json"
+        self.fleet_mode = fleet_mode
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.headless = headless
+        self.client_factory = client_factory
+        self.version = 0
+        self.state = FleetState()
+        self.sessions = SessionTracker()
+        self.pending = {}
+        self.sent = {}
+        self.runtime = Runtime()
+        # BLEDevice objects seen by the last scan, a charger selected from them connects without another discovery
+        self.scanned_devices = {}
+        self.push_lock = threading.Lock()
+        # scripts for the window, evaluated by a worker thread in order
+        self.client_scripts = queue.Queue()
+        self.state_changed = threading.Condition(self.push_lock)
+
+        if fleet_mode:
+            config_name = "config-fleet.json"
+        elif mc5000_mode:
+            config_name = "config-mc5000.json"
+        else:
+            config_name = "config.json"
         self.config = config.Config(config_name)
 
+        self.eta = EtaEstimator(Targets.from_config(self.config.read("eta")))
+
+        # battery info of all slots is pushed to UI in one frame at most this many times per second
+        self.push_interval = 1 / self.config.read("ui_refresh_rate", 4)
+        self.broadcaster = Broadcaster(self.config.read("stream_queue_size", 256))
+
         gui_dir = os.path.join(os.path.dirname(__file__), "..", "..", "assets")
         if not os.path.exists(gui_dir):
             gui_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
@@ -63,19 +114,48 @@ class Server:
         app.after_request(self.after_request)
 
         if self.profiles_mode:
+            from profiles import ProfilesController
             self.profiles_controller = ProfilesController(self, self.config)
             self.profiles_controller.register(app)
         else:
+            # a replay isn't recorded - its frames would be stored as current data of the real charger
+            if self.config.read("history", True) and not self.replay:
+                self.series = TimeSeriesStore(default_charger=self.get_model())
+            if self.config.read("session_log", True) and not self.replay:
+                self.session_log = SessionLog(default_charger=self.get_model())
+                self.session_log.start()
+                self.sessions.listeners.append(self.session_log.append_summary)
+
             app.add_url_rule("/", "index", self.index)
             app.add_url_rule("/scan", "scan", self.scan)
             app.add_url_rule("/scan/trigger", "scan_trigger", self.scan_trigger)
             app.add_url_rule("/scan/select", "scan_select", self.scan_select)
-
-        self.notify = Notify(
-            default_notification_title="%s status update" % app_name,
-            default_notification_application_name="%s BLE" % app_name,
-            default_notification_icon=os.path.join(project_dir, "assets", "img", "icon.ico"),
-        )
+            app.add_url_rule("/series/<int:slot>", "series", self.series_data)
+            app.add_url_rule("/state", "state", self.state_data)
+            app.add_url_rule("/stream", "stream", self.stream)
+            app.add_url_rule("/api/state", "api_state", self.api_state)
+            app.add_url_rule("/metrics", "metrics", self.metrics_data)
+            app.add_url_rule("/diagnostics", "diagnostics", self.diagnostics)
+            app.add_url_rule("/api/diagnostics", "api_diagnostics", self.api_diagnostics)
+            app.add_url_rule("/debug/perf", "perf", self.perf)
+            app.add_url_rule("/debug/perf.json", "perf_data", self.perf_data)
+            app.add_url_rule("/debug/perf/<action>", "perf_action", self.perf_action, methods=["POST"])
+
+            self.register_perf()
+            if self.config.read("perf", False):
+                PERF.enable()
+            app.add_url_rule("/api/sessions", "api_sessions", self.api_sessions)
+            app.add_url_rule("/api/log/sessions", "log_sessions", self.log_sessions)
+            app.add_url_rule("/api/log/frames/<int:slot>", "log_frames", self.log_frames)
+
+        self.notify = None
+        if not headless:
+            from notifypy import Notify
+            self.notify = Notify(
+                default_notification_title="%s status update" % app_name,
+                default_notification_application_name="%s BLE" % app_name,
+                default_notification_icon=os.path.join(project_dir, "assets", "img", "icon.ico"),
+            )
 
     def context_processor(self):
         variables: dict = {
@@ -89,81 +169,455 @@ class Server:
         return response
 
     def index(self):
-        if self.config.read("ble_address") is None:
+        if not self.is_configured():
             return redirect(url_for("scan"))
-        return render_template("index.html")
+        return render_template("index.html", chargers=self.get_charger_names())
+
+    def is_configured(self):
+        if self.replay or self.is_simulated():
+            return True
+        if self.fleet_mode:
+            return len(self.config.read("chargers", [])) > 0
+        return self.config.read("ble_address") is not None
+
+    def is_simulated(self):
+        return self.client_factory is not bleak.BleakClient
+
+    def get_model(self):
+        return "mc5000" if self.mc5000_mode else "mc3000"
+
+    def get_charger_names(self):
+        if not self.fleet_mode:
+            return [None]
+        return [section.get("name", section["address"]) for section in self.config.read("chargers", [])]
 
     def scan(self):
-        return render_template("scan.html")
+        return render_template("scan.html", models=sorted(Charger.models) if self.fleet_mode else None)
+
+    def state_data(self):
+        """
+        Full state of all slots in the same format as pushed updates, used by the client to resync after (re)load.
+        """
+        with self.push_lock:
+            entries = self.get_state_entries()
+        return jsonify({
+            "battery_infos": entries,
+        })
+
+    def get_state_entries(self):
+        entries = []
+        for (charger, slot), fields in self.sent.items():
+            entries.append({
+                "charger": charger,
+                "slot": slot,
+                "timestamp": self.last_update_time,
+                "changes": dict(fields),
+            })
+        return entries
+
+    def api_state(self):
+        """
+        Latest snapshot of all slots with a version counter, the version is also sent as ETag.
+
+        Long-polling: with `?version=N&wait=S` (or `If-None-Match` and `wait`) the request blocks up to S seconds
+        until the state differs from version N. Without `wait` an unchanged version is answered with 304.
+        """
+        version = request.args.get("version", type=int)
+        if version is None:
+            etag = request.headers.get("If-None-Match", "").strip('"')
+            version = int(etag) if etag.isdigit() else None
+        wait = min(request.args.get("wait", 0, type=float), 60)
+
+        with self.state_changed:
+            if version is not None and wait > 0:
+                self.state_changed.wait_for(lambda: self.version != version, timeout=wait)
+            current = self.version
+            if version == current:
+                response = flask.Response(status=304)
+            else:
+                slots = []
+                for entry in self.get_state_entries():
+                    slots.append({
+                        "charger": entry["charger"],
+                        "slot": entry["slot"],
+                        "battery_info": entry["changes"],
+                    })
+                response = jsonify({
+                    "version": current,
+                    "timestamp": self.last_update_time,
+                    "slots": slots,
+                })
+
+        response.headers["ETag"] = '"%s"' % current
+        return response
+
+    def stream(self):
+        """
+        Server-sent events stream of per-slot telemetry, every `battery_info` event carries the full state
+        of one slot. Starts with the current state of all slots. Every client has its own bounded queue,
+        when the client is too slow the oldest events are dropped and a `dropped` event tells how many.
+        """
+        subscription = self.broadcaster.subscribe()
+        with self.push_lock:
+            snapshot = [(charger, dict(fields)) for (charger, slot), fields in self.sent.items()]
+
+        def generate():
+            try:
+                for charger, battery_info in snapshot:
+                    yield encode_event("battery_info", self.encode_stream_payload(
+                        battery_info, charger, self.last_update_time
+                    ))
+
+                while True:
+                    message = subscription.get(timeout=15)
+                    dropped = subscription.take_dropped()
+                    if dropped:
+                        yield encode_event("dropped", json.dumps({"count": dropped}))
+                    if message is None:
+                        yield ": keep-alive\n\n"
+                    else:
+                        yield message
+            finally:
+                self.broadcaster.unsubscribe(subscription)
+
+        return flask.Response(generate(), mimetype="text/event-stream", headers={
+            "X-Accel-Buffering": "no",
+        })
+
+    def encode_stream_payload(self, battery_info, charger, timestamp):
+        return json.dumps({
+            "charger": charger,
+            "timestamp": timestamp,
+            "battery_info": battery_info,
+        })
+
+    def metrics_data(self):
+        return flask.Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    def diagnostics(self):
+        return render_template("diagnostics.html", chargers=self.get_link_reports())
+
+    def api_diagnostics(self):
+        return jsonify(self.get_link_reports())
+
+    def get_link_reports(self):
+        return [charger_metrics.get_link_report() for charger_metrics in list(metrics.CHARGERS.values())]
+
+    def register_perf(self):
+        """
+        Stages from the notification arrival to the UI push, timed only while `PERF` is enabled. The notification
+        callback is bound when the connection is made, so the "notification" stage covers connections made
+        after enabling.
+        """
+        for service_class in (MC3000Ble, MC5000Ble):
+            PERF.instrument(service_class, "_request_slot", "ble request")
+            PERF.instrument(service_class, "_async_callback", "notification")
+            PERF.instrument(service_class, "parse_battery_info", "decode")
+        PERF.instrument(mc3000ble, "calculate_checksum", "checksum")
+        PERF.instrument(mc5000ble, "calculate_checksum", "checksum")
+        PERF.instrument(Server, "_update", "update")
+        PERF.instrument(FleetState, "update", "update state")
+        PERF.instrument(SessionTracker, "update", "update sessions")
+        PERF.instrument(EtaEstimator, "update", "update eta")
+        PERF.instrument(TimeSeriesStore, "append", "update history")
+        PERF.instrument(SessionLog, "append", "update session log")
+        PERF.instrument(Server, "format_duration", "format duration")
+        PERF.instrument(Server, "push_battery_info", "push")
+        PERF.instrument(Server, "encode_stream_payload", "stream encode")
+        PERF.instrument(Server, "flush_client_side", "flush")
+        PERF.instrument(Server, "evaluate_js", "evaluate_js")
+        PERF.instrument(Server, "send_notification", "notification popup")
+
+    def perf(self):
+        return render_template("perf.html", report=PERF.report())
+
+    def perf_data(self):
+        return jsonify(PERF.report())
+
+    def perf_action(self, action):
+        """
+        `enable`, `disable`, `reset` or `dump` - the report is written to a JSON file in the data directory,
+        only on request from this computer (the headless monitor may listen on all interfaces).
+        """
+        if action == "enable":
+            PERF.enable()
+        elif action == "disable":
+            PERF.disable()
+        elif action == "reset":
+            PERF.reset()
+        elif action == "dump":
+            if request.remote_addr not in LOCAL_ADDRESSES:
+                return jsonify({"error": "dump is allowed only from localhost"}), 403
+            path = os.path.join(config.data_dir, "perf-%s.json" % pendulum.now().format("YYYYMMDD-HHmmss"))
+            PERF.dump(path)
+            logging.info("perf report written to %s" % path)
+            return jsonify({
+                "path": path,
+            })
+        else:
+            return jsonify({"error": "unknown action '%s'" % action}), 404
+        return redirect(url_for("perf"))
+
+    def api_sessions(self):
+        """
+        Running sessions and summaries of finished ones (persisted in the session log when enabled),
+        optionally filtered by `charger` and `slot`.
+        """
+        charger = request.args.get("charger")
+        slot = request.args.get("slot", type=int)
+        running = [
+            session for session in self.sessions.get_running()
+            if (charger is None or session["charger"] == charger) and (slot is None or session["slot"] == slot)
+        ]
+        if self.session_log is not None:
+            finished = self.session_log.summaries(
+                self.get_log_charger(charger), slot, limit=request.args.get("limit", 100, type=int),
+            )
+        else:
+            finished = self.sessions.get_finished(charger, slot)[::-1]
+        return jsonify({
+            "running": running,
+            "finished": finished,
+        })
+
+    def log_sessions(self):
+        """
+        Past sessions from the session log, optionally filtered by `charger`, `slot` and `start`/`end` (unix time).
+        """
+        if self.session_log is None:
+            return jsonify([])
+        return jsonify(self.session_log.sessions(
+            charger=self.get_log_charger(request.args.get("charger")),
+            slot=request.args.get("slot", type=int),
+            start=request.args.get("start", type=float),
+            end=request.args.get("end", type=float),
+        ))
+
+    def get_log_charger(self, charger):
+        """
+        Charger name in the session log - a single charger monitor logs under its model and sees only its own
+        sessions, the database is shared with the monitor of the other model.
+        """
+        if charger is None and not self.fleet_mode:
+            return self.get_model()
+        return charger
+
+    def log_frames(self, slot):
+        if self.session_log is None:
+            return jsonify([])
+        return jsonify(self.session_log.frames(
+            self.get_log_charger(request.args.get("charger")),
+            slot,
+            start=request.args.get("start", type=float),
+            end=request.args.get("end", type=float),
+            limit=min(request.args.get("limit", 10000, type=int), 100000),
+        ))
+
+    def series_data(self, slot):
+        """
+        Chart data of given slot, `since` (unix time) limits the response to points newer than the last point
+        the client already has, `points` is the maximum number of points per metric after downsampling.
+        Only slots of configured chargers are served.
+        """
+        if self.series is None:
+            return jsonify({})
+        charger = request.args.get("charger") or None
+        # both chargers have 4 slots
+        if slot > 3 or charger not in self.get_charger_names():
+            return jsonify({"error": "unknown slot %s of charger '%s'" % (slot, charger)}), 404
+        since = request.args.get("since", type=float)
+        if since is None:
+            since = time() - self.config.read("chart_hours", 12) * 3600
+        points = min(request.args.get("points", 500, type=int), 5000)
+        return jsonify(self.series.query_chart(charger, slot, start=since, points=points))
 
     def scan_trigger(self):
-        if self.scan_thread is None:
-            self.scan_thread = SafeThread(target=self._background_scan, daemon=True)
-            self.scan_thread.start()
+        if self.scan_future is None or self.scan_future.done():
+            show_all = request.args.get("all", 0, type=int) == 1
+            self.scan_future = self.runtime.submit(self._scan_async(show_all))
         return jsonify({
             "status": "ok",
         })
 
     def scan_select(self):
+        """
+        Selects the charger `ble_address`. In fleet mode the charger is added with `model` chosen in Setup,
+        or the model inferred from its advertised name.
+        """
         ble_address = request.args.get("ble_address")
-        self.config.write("ble_address", ble_address)
+        device = self.scanned_devices.get(ble_address)
+        name = device.name if device is not None else None
+        model = self.get_model()
+        if self.fleet_mode:
+            model = request.args.get("model") or infer_model(name) or model
+            if model not in Charger.models:
+                return jsonify({"error": "unknown charger model '%s'" % model}), 400
+
+        known_devices = self.config.read("known_devices", {})
+        known_devices[ble_address] = {
+            "name": name,
+            "model": model,
+        }
+        self.config.write("known_devices", known_devices)
+        if self.fleet_mode:
+            chargers = self.config.read("chargers", [])
+            if ble_address not in [section["address"] for section in chargers]:
+                chargers.append({
+                    "name": ble_address,
+                    "address": ble_address,
+                    "model": model,
+                })
+            self.config.write("chargers", chargers)
+        else:
+            self.config.write("ble_address", ble_address)
         self.spawn_service()
         return jsonify({
             "status": "ok",
         })
 
-    def _background_scan(self):
+    async def _scan_async(self, show_all=False):
         try:
-            if self.service_thread is not None:
+            if self.service_future is not None:
                 self.service.stop()
-                self.service_thread.join()
-                self.service_thread = None
+                await asyncio.wrap_future(self.service_future)
+                self.service_future = None
 
             self.disable_timeout()
 
-            async def run():
-                logging.info("scanning started")
-                scanner = bleak.BleakScanner()
-                devices = await scanner.discover()
-                formatted = []
-                for device in devices:
-                    formatted.append({
-                        "address": device.address,
-                        "name": device.name,
-                    })
-                return formatted
-
-            data = self.get_loop().run_until_complete(run())
-            logging.info("scanning done")
-
-            results = ["Results:"]
-            if len(data) == 0:
-                results.append("no device found, try again")
-
-            for device in data:
-                if device["name"] is None:
-                    device["name"] = "unknown"
-                name = "%s (%s)" % (device["address"], device["name"])
-                results.append("<a href=\"#\" data-address=\"" + device["address"] + "\">" + name + "</a>")
+            scanner = ChargerScanner(
+                MC3000Ble.SERVICE_UUID,
+                names=self.config.read("scan_names", CHARGER_NAMES),
+                show_all=show_all,
+                stop_on_match=self.config.read("scan_stop_on_match", False),
+                timeout=self.config.read("scan_timeout", 10),
+                device_callback=self._scan_detected,
+            )
+            results = await scanner.run()
+            for address, result in results.items():
+                self.scanned_devices[address] = result.device
 
             self.update_client_side({
-                "scan_results": "<br>".join(results),
+                "scan_done": {
+                    "devices": len(results),
+                    "chargers": len([result for result in results.values() if result.matched]),
+                },
             })
-
-            self.scan_thread = None
         except Exception as e:
             logging.exception(e)
             self.update_client_side({
-                "scan_results": "error, please try again"
+                "scan_done": {
+                    "error": "error, please try again",
+                },
             })
 
+    def _scan_detected(self, result):
+        self.update_client_side({
+            "scan_device": result.to_dict(),
+        })
+
     def update_client_side(self, payload):
-        for window in webview.windows:
-            payload = json.dumps(payload)
-            payload = payload.replace("\\", "\\\\")
-            window.evaluate_js("window.app.update('" + payload + "');")
+        if self.headless:
+            return
+        import webview
+        if not webview.windows:
+            return
+        payload = json.dumps(payload)
+        payload = payload.replace("\\", "\\\\").replace("'", "\\'")
+        script = "window.app.update('" + payload + "');"
+        self.client_scripts.put(script)
+
+    def _client_writer(self):
+        """
+        `evaluate_js` blocks until the window ran the script, so it's called here instead of the BLE loop.
+        """
+        import webview
+        while True:
+            script = self.client_scripts.get()
+            for window in webview.windows:
+                self.evaluate_js(window, script)
+
+    def evaluate_js(self, window, script):
+        window.evaluate_js(script)
+
+    def push_battery_info(self, battery_info, charger, timestamp):
+        """
+        Sends only fields which changed since the last value sent for given slot, the client keeps
+        the full state and resyncs from `/state` on (re)load.
+
+        Changes of all slots are coalesced into one UI frame, pushed when the service finished a polling round
+        (see `_sweep_done`). Slots of a round that never finishes are pushed by a timer.
+        """
+        key = (charger, battery_info["slot"])
+        with self.push_lock:
+            sent = self.sent.get(key)
+            if sent is None:
+                sent = self.sent[key] = {}
+            changes = {}
+            for field, value in battery_info.items():
+                if field not in sent or sent[field] != value:
+                    sent[field] = changes[field] = value
+            if changes:
+                self.version += 1
+                self.state_changed.notify_all()
+
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = {
+                    "charger": charger,
+                    "slot": battery_info["slot"],
+                    "timestamp": timestamp,
+                    "changes": changes,
+                }
+            else:
+                entry["timestamp"] = timestamp
+                entry["changes"].update(changes)
+
+            if self.push_timer is None:
+                delay = max(self.last_push + self.push_interval - monotonic(), 0)
+                # the flush runs on the runtime loop instead of a timer thread, whichever thread calls this
+                self.push_timer = self.runtime.call_later(delay, self.flush_client_side)
+
+    def _sweep_done(self, charger=None):
+        """
+        Called by the service after every polling round - the UI frame is pushed at most once per `push_interval`,
+        rounds finished before the interval elapses are pushed by a timer.
+        """
+        with self.push_lock:
+            if not self.pending:
+                return
+            delay = self.last_push + self.push_interval - monotonic()
+            flush = delay <= 0
+            if not flush:
+                if self.push_timer is not None:
+                    self.push_timer.cancel()
+                self.push_timer = self.runtime.call_later(delay, self.flush_client_side)
+
+        if flush:
+            self.flush_client_side()
+
+    def flush_client_side(self):
+        with self.push_lock:
+            if self.push_timer is not None:
+                self.push_timer.cancel()
+                self.push_timer = None
+            entries = list(self.pending.values())
+            self.pending = {}
+            self.last_push = monotonic()
+
+        # the separator blinks once per UI frame, not per polling round of every charger
+        separator = "•" if self.separator else "⁃"
+        self.separator = not self.separator
+        self.set_title("%s %s %s" % (self.title, separator, pendulum.now().format("HH:mm:ss")))
+
+        if entries:
+            self.update_client_side({
+                "battery_infos": entries,
+            })
 
     def set_title(self, title):
+        if self.headless:
+            return
+        import webview
         for window in webview.windows:
             window.set_title(title)
 
@@ -176,102 +630,171 @@ class Server:
                     values["v"] = int(os.stat(file_path).st_mtime)
         return flask.url_for(endpoint, **values)
 
-    def get_loop(self):
-        if not self.loop:
-            self.loop = asyncio.new_event_loop()
-        return self.loop
-
-    def run(self, host="127.0.0.1"):
+    def run(self, host="127.0.0.1", port=0):
         logging.getLogger("werkzeug").setLevel(logging.WARNING)
 
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.bind((host, 0))
-        port = sock.getsockname()[1]
-        sock.close()
+        if not port:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind((host, 0))
+            port = sock.getsockname()[1]
+            sock.close()
 
         self.address = (host, port)
+        logging.info("listening on http://%s:%s" % self.address)
 
         if not self.profiles_mode:
+            self.runtime.start()
             self.spawn_service()
-            self.spawn_timeout()
         self.app.run(host=host, port=port, threaded=True, use_reloader=False)
 
+    def close(self):
+        """
+        Stops the BLE service and closes the stores, frames still queued for the session log are written.
+        """
+        if self.service is not None:
+            self.service.stop()
+        self.runtime.stop()
+        if self.session_log is not None:
+            self.session_log.close()
+        if self.series is not None:
+            self.series.close()
+
     def spawn_service(self):
-        if self.config.read("ble_address") is None:
+        if not self.is_configured():
             return
 
-        if self.service_thread is None:
-            self.service_thread = SafeThread(target=self._background_service, daemon=True)
-            self.service_thread.start()
+        if self.service_future is None or self.service_future.done():
+            self.service_future = self.runtime.submit(self._service_async())
+
+    async def _service_async(self):
+        if self.replay:
+            service = create_service(self.get_model())
+            service.sweep_callback = self._sweep_done
+            self.service = Replay(service, self.replay, self.replay_speed)
+            await self.service.run_async(self.receive_callback)
+            return
 
-    def spawn_timeout(self):
-        if self.timeout_thread is None:
-            self.timeout_thread = SafeThread(target=self._background_timeout, daemon=True)
-            self.timeout_thread.start()
+        if self.fleet_mode:
+            self.service = Fleet.from_config(
+                self.config.read("chargers", []),
+                client_factory=self.client_factory,
+                connection_callback=self._connection_changed,
+                sweep_callback=self._sweep_done,
+                polling=self.config.read("polling"),
+                devices=self.scanned_devices,
+                known_addresses=set(self.config.read("known_devices", {})),
+            )
+            await self.service.run_async(self.receive_callback)
+            return
 
-    def _background_service(self):
+        ble_address = self.config.read("ble_address")
+        if ble_address is None and self.is_simulated():
+            ble_address = "00:00:00:00:00:00"
         if self.mc5000_mode:
-            self.service = MC5000Ble(ble_address=self.config.read("ble_address"))
+            service = MC5000Ble(
+                ble_address=ble_address, client_factory=self.client_factory, in_flight=self.config.read("in_flight", 1),
+            )
         else:
-            self.service = MC3000Ble(ble_address=self.config.read("ble_address"))
-
-        while True:
-            try:
-                self.service.run(self._update)
-            except (bleak.BleakError, asyncio.TimeoutError) as e:
-                logging.exception(e)
-                if self.service.running:
-                    sleep(1)
-
-            if not self.service.running:
-                break
-
-    def _update(self, battery_info):
-        if battery_info["time"].total_seconds() == 0:
-            battery_info["time"] = "0 seconds"
+            service = MC3000Ble(ble_address=ble_address, client_factory=self.client_factory)
+        service.device = self.scanned_devices.get(ble_address)
+        service.scheduler = PollScheduler.from_config(service.interval, self.config.read("polling"))
+        service.sweep_callback = self._sweep_done
+
+        capture = None
+        if self.config.read("capture", False):
+            capture = CaptureWriter(create_capture_path(self.get_model()), self.get_model())
+            service.raw_receive_callback = capture.write
+            logging.info("capturing raw frames to %s" % capture.path)
+
+        self.service = Watchdog(
+            service,
+            connection_callback=self._connection_changed,
+            resolve_device=not self.is_simulated(),
+            known=ble_address in self.config.read("known_devices", {}),
+        )
+        try:
+            await self.service.run_async(self.receive_callback)
+        finally:
+            if capture is not None:
+                capture.close()
+
+    def receive_callback(self, battery_info, charger=None):
+        # `_update` is looked up on every frame, so it's timed as soon as perf instrumentation is enabled
+        self._update(battery_info, charger)
+
+    def _update(self, battery_info, charger=None):
+        timestamp = time()
+        self.state.update(battery_info, charger)
+        self.sessions.update(battery_info, charger, timestamp)
+        eta = self.eta.update(battery_info, charger, timestamp)
+        if self.series is not None:
+            self.series.append(battery_info, charger, timestamp)
+        if self.session_log is not None:
+            self.session_log.append(battery_info, charger, timestamp)
+        battery_info = battery_info.to_dict()
+        battery_info["time"] = self.format_duration(battery_info["time"])
+
+        # rounded to minutes, so the estimate doesn't change (and isn't pushed) with every frame
+        if eta is None:
+            battery_info["eta_seconds"] = None
+            battery_info["eta"] = "-"
         else:
-            time_string = battery_info["time"].in_words(separator=";")
-            time_pieces = time_string.split(";")
-            while len(time_pieces) > 2:
-                time_pieces.pop(-1)
-            battery_info["time"] = " ".join(time_pieces)
-
-        self.update_client_side({
-            "battery_info": battery_info,
-        })
-
-        self.last_update_time = time()
+            eta = int(round(eta / 60)) * 60
+            battery_info["eta_seconds"] = eta
+            battery_info["eta"] = self.format_duration(pendulum.duration(seconds=eta))
 
         slot_index = battery_info["slot"]
-        if slot_index == 3:
-            separator = "•" if self.separator else "⁃"
-            self.separator = not self.separator
-            self.set_title("%s %s %s" % (self.title, separator, pendulum.now().format("HH:mm:ss")))
+        self.push_battery_info(battery_info, charger, timestamp)
+        if self.broadcaster.has_subscribers():
+            self.broadcaster.publish("battery_info", self.encode_stream_payload(battery_info, charger, timestamp))
+
+        self.last_update_time = timestamp
 
-        if slot_index not in self.previous:
-            self.previous[slot_index] = None
+        slot_key = (charger, slot_index)
+        if slot_key not in self.previous:
+            self.previous[slot_key] = None
 
         if battery_info["status"].lower() not in ["standby", "charging", "discharging"]:
-            if self.previous[slot_index] != battery_info["status"]:
-                self.notify.message = "Slot %s changed status to '%s'" % (slot_index + 1, battery_info["status"])
-                self.notify.send()
+            if self.previous[slot_key] != battery_info["status"]:
+                slot_name = "Slot %s" % (slot_index + 1)
+                if charger is not None:
+                    slot_name = "%s slot %s" % (charger, slot_index + 1)
+                self.send_notification("%s changed status to '%s'" % (slot_name, battery_info["status"]))
+
+        if self.previous[slot_key] != battery_info["status"]:
+            self.previous[slot_key] = battery_info["status"]
+
+    def format_duration(self, duration):
+        if duration.total_seconds() == 0:
+            return "0 seconds"
+        time_pieces = duration.in_words(separator=";").split(";")
+        while len(time_pieces) > 2:
+            time_pieces.pop(-1)
+        return " ".join(time_pieces)
+
+    def _connection_changed(self, connected, charger=None):
+        """
+        Called by the connection watchdog right when a charger connects or loses the connection.
+        """
+        if connected:
+            self.waiting = False
+            return
 
-        if self.previous[slot_index] != battery_info["status"]:
-            self.previous[slot_index] = battery_info["status"]
+        if charger is not None:
+            self.send_notification("Lost connection with charger %s!" % charger)
+            return
 
-    def _background_timeout(self):
-        while True:
-            if self.last_update_time is not None:
-                if self.last_update_time < time() - 10:
-                    if not self.waiting:
-                        self.set_title_connecting()
-                        self.notify.message = "Lost connection with charger!"
-                        self.notify.send()
-                    self.waiting = True
-                else:
-                    self.waiting = False
-
-            sleep(1)
+        if not self.waiting:
+            self.set_title_connecting()
+            self.send_notification("Lost connection with charger!")
+        self.waiting = True
+
+    def send_notification(self, message):
+        if self.notify is None:
+            logging.info(message)
+            return
+        self.notify.message = message
+        self.notify.send()
 
     def disable_timeout(self):
         self.last_update_time = None
@@ -303,15 +826,17 @@ class Server:
             parameters["title"] = "%s USB Profiles" % server.title
         else:
             parameters["width"] = self.config.read("monitor_window_width", 780)
-            parameters["height"] = self.config.read("monitor_window_height", 370)
+            parameters["height"] = self.config.read("monitor_window_height", 500)
             parameters["x"] = self.config.read("monitor_window_x", None)
             parameters["y"] = self.config.read("monitor_window_y", None)
             parameters["title"] = "%s - Trying to connect..." % server.title
 
         self.clamp_coordinates(parameters)
 
+        import webview
         self.window = webview.create_window(**parameters)
         self.window.events.closing += self.on_close
+        SafeThread(target=self._client_writer, daemon=True).start()
         webview.start(debug="FLASK_DEBUG" in os.environ)
 
     def on_close(self):
@@ -331,6 +856,7 @@ class Server:
             "bottom": 0,
         }
 
+        from screeninfo import screeninfo
         for monitor in screeninfo.get_monitors():
             if monitor.x < extreme["left"]:
                 extreme["left"] = monitor.x
@@ -380,17 +906,50 @@ class Api:
 
 
 if __name__ == "__main__":
-    argument = sys.argv[1] if len(sys.argv) > 1 else None
+    arguments = sys.argv[1:]
+    headless = len(arguments) > 0 and arguments[0] == "headless"
+    if headless:
+        arguments = arguments[1:]
+    argument = arguments[0] if len(arguments) > 0 else None
     profiles_mode = argument == "profiles"
     mc5000_mode = argument == "mc5000"
-    app_name = "MC5000" if mc5000_mode else "MC3000"
+    fleet_mode = argument == "fleet"
+    client_factory = bleak.BleakClient
+    if argument == "simulate":
+        # simulate mc3000|mc5000|fleet [speed] - simulated chargers instead of BLE devices
+        from simulator import Simulator
+        arguments = arguments[1:]
+        argument = arguments[0] if len(arguments) > 0 else None
+        speed = float(arguments[1]) if len(arguments) > 1 else 1
+        client_factory = Simulator(speed=speed).create_client
+        mc5000_mode = argument == "mc5000"
+        fleet_mode = argument == "fleet"
+    replay = None
+    replay_speed = 1
+    if argument == "replay":
+        # replay <capture file> [speed]
+        replay = arguments[1]
+        replay_speed = float(arguments[2]) if len(arguments) > 2 else 1
+        mc5000_mode = CaptureReader(replay).model == "mc5000"
+    if fleet_mode:
+        app_name = "Fleet"
+    elif mc5000_mode:
+        app_name = "MC5000"
+    else:
+        app_name = "MC3000"
 
     config.setup_logging(app_name)
 
+    server = None
     try:
         logging.info("starting")
 
-        server = Server(app_name, profiles_mode=profiles_mode, mc5000_mode=mc5000_mode)
+        server = Server(app_name, profiles_mode=profiles_mode, mc5000_mode=mc5000_mode, fleet_mode=fleet_mode,
+                        replay=replay, replay_speed=replay_speed, headless=headless, client_factory=client_factory)
+        if headless:
+            server.run(host=server.config.read("http_host", "127.0.0.1"), port=server.config.read("http_port", 0))
+            exit(0)
+
         SafeThread(target=server.run, daemon=True).start()
 
         while not isinstance(server.address, tuple):
@@ -402,3 +961,6 @@ if __name__ == "__main__":
     except Exception as e:
         logging.exception(e)
         exit(1)
+    finally:
+        if server is not None:
+            server.close()
@@ -1,12 +1,18 @@
 import asyncio
+from asyncio import Event
 import logging
+import struct
 import sys
-from time import time
+from time import monotonic
 
 from bleak import BleakClient
-import pendulum
 
-from shared import calculate_checksum
+from cadence import PollScheduler
+from metrics import ChargerMetrics
+from shared import RateLimitedLog, calculate_checksum
+from telemetry import BatteryInfo, NO_RESISTANCE, build_mode_labels
+
+NO_MODES = {}
 
 
 class MC3000Ble:
@@ -28,6 +34,14 @@ class MC3000Ble:
     HEADER = 0x0F  # 15
     BATTERY_INFO = 0x55  # 85
 
+    # response timeout is derived from the smoothed request -> notification latency and kept within these bounds
+    RESPONSE_TIMEOUT_MIN = 0.250
+    RESPONSE_TIMEOUT_MAX = 3
+    RESPONSE_TIMEOUT_FACTOR = 4
+
+    # shortest pause between polling rounds
+    POLL_WAIT_MIN = 0.010
+
     types = {0: "LiIon", 1: "LiFe", 2: "LiIo4_35", 3: "NiMH", 4: "NiCd", 5: "NiZn", 6: "Eneloop", 7: "Ram", 8: "Batlto"}
     modes = {
         0: {0: "Charge", 1: "Refresh", 2: "Storage", 3: "Discharge", 4: "Cycle"},
@@ -60,95 +74,159 @@ class MC3000Ble:
         139: "Wrong polarity",
         140: "Bad battery (high IR)",
     }
+    mode_labels = build_mode_labels(modes, modes_types_mapping)
 
-    def __init__(self, ble_address, interval=1):
+    # header, command, slot, type, mode, count, status, time, voltage, current, capacity, temperature, resistance,
+    # led, checksum
+    BATTERY_INFO_FRAME = struct.Struct(">7B4HBHBB")
+
+    def __init__(self, ble_address, interval=1, client_factory=BleakClient, name=None):
         self.ble_address = ble_address
         self.interval = interval
+        self.client_factory = client_factory
+        self.device = None
+        # client of the latest connection attempt
+        self.client = None
+        self.disconnected_callback = None
+        self.metrics = ChargerMetrics(ble_address, name)
+        self.log = RateLimitedLog()
+        # created on the loop of the service, an Event bound to another loop fails on Python 3.8/3.9
+        self.response_event = None
+        self.pending_slot = None
+        self.latency = None
+        self.scheduler = PollScheduler(interval)
+        self.sweep_latencies = []
+        self.sweep_time = None
         self.running = False
         self.receive_callback = None
 
     def run(self, receive_callback):
+        asyncio.run(self.run_async(receive_callback))
+
+    async def run_async(self, receive_callback):
         logging.info("service started")
         self.running = True
         self.receive_callback = receive_callback
-        asyncio.run(self._loop_async())
+        self.response_event = Event()
+        await self._loop_async()
 
     def stop(self):
         self.running = False
+        self.metrics.close()
         logging.info("service stopped")
 
+    def _disconnected(self, client):
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(client)
+
     async def _loop_async(self):
-        interval = float(self.interval)
-        begin = time()
-        slots = range(0, 4)
-        async with BleakClient(self.ble_address) as client:
+        device = self.device if self.device is not None else self.ble_address
+        self.client = self.client_factory(device, disconnected_callback=self._disconnected)
+        async with self.client as client:
             await client.start_notify(self.CHARACTERISTIC_UUID, self._async_callback)
 
             while self.running:
-                for slot in slots:
-                    await asyncio.sleep(0.100)
-                    await client.write_gatt_char(self.CHARACTERISTIC_UUID, self.get_channel_request_data(slot))
+                sweep_begin = monotonic()
+                latencies = []
+                for slot in self.scheduler.due(sweep_begin):
+                    latencies.append(await self._request_slot(client, slot))
+
+                if latencies:
+                    self.sweep_latencies = latencies
+                    self.sweep_time = monotonic() - sweep_begin
+                    logging.debug("sweep done in %.3f s, slot latencies: %s" % (self.sweep_time, latencies))
+                    self.sweep_callback()
 
-                await asyncio.sleep(interval - ((time() - begin) % interval))
+                await asyncio.sleep(max(self.scheduler.wait(), self.POLL_WAIT_MIN))
 
             await client.stop_notify(self.CHARACTERISTIC_UUID)
 
+    async def _request_slot(self, client, slot):
+        """
+        Sends the request for given slot and waits until the matching notification arrives.
+        Returns request -> notification latency in seconds or None when the response timed out.
+        """
+        self.response_event.clear()
+        self.pending_slot = slot
+        sent = monotonic()
+        try:
+            await client.write_gatt_char(self.CHARACTERISTIC_UUID, self.get_channel_request_data(slot))
+            await asyncio.wait_for(self.response_event.wait(), timeout=self.get_response_timeout())
+        except asyncio.TimeoutError:
+            self.metrics.observe_missed(slot)
+            logging.debug("response for slot %s timed out" % slot)
+            return None
+        finally:
+            self.pending_slot = None
+            self.scheduler.polled(slot)
+
+        latency = monotonic() - sent
+        self.metrics.observe_reply(slot, latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += (latency - self.latency) / 8
+        return latency
+
+    def get_response_timeout(self):
+        if self.latency is None:
+            return self.RESPONSE_TIMEOUT_MAX
+        timeout = self.latency * self.RESPONSE_TIMEOUT_FACTOR
+        return min(max(timeout, self.RESPONSE_TIMEOUT_MIN), self.RESPONSE_TIMEOUT_MAX)
+
     async def _async_callback(self, sender, data):
         self.raw_receive_callback(data)
+        self.metrics.notifications.inc()
 
         expected = calculate_checksum(data[:-1])
         if expected != data[-1]:
-            logging.warning("checksum check failed, expected: %s, got: %s, payload: %s" % (
+            self.metrics.checksum_failures.inc()
+            self.log.warning("checksum", "checksum check failed, expected: %s, got: %s, payload: %s" % (
                 expected, data[-1], data,
             ))
             return
 
         if data[1] == self.BATTERY_INFO:
             battery_info = self.parse_battery_info(data)
+            self.metrics.observe(battery_info)
+            self.scheduler.observe(battery_info)
             if self.receive_callback:
                 callback = self.receive_callback
                 # noinspection PyCallingNonCallable
                 callback(battery_info)
 
+            if battery_info.slot == self.pending_slot:
+                self.response_event.set()
+            else:
+                self.metrics.unsolicited.inc()
+
     def raw_receive_callback(self, data):
         pass  # virtual
 
-    def parse_battery_info(self, data):
-        battery_info = {
-            "slot": data[2],
-        }
+    def sweep_callback(self):
+        pass  # virtual, called after every polling round
 
-        battery_type = data[3] & 255
-        battery_info["type"] = self.types.get(battery_type, "unknown")
-
-        available_modes = []
-        for mode_group, applicable_types in self.modes_types_mapping.items():
-            if battery_type in applicable_types:
-                available_modes = self.modes[mode_group]
-                break
-
-        mode = data[4] & 255
-        battery_info["mode"] = available_modes.get(mode, "unknown")
-        battery_info["count"] = data[5] & 255
-
-        status = data[6] & 255
-        battery_info["status"] = self.statuses[status] if status in self.statuses else "unknown error"
-
-        seconds = ((data[7] & 255) * 256) + (data[8] & 255)
-        battery_info["time"] = pendulum.duration(seconds=seconds)
-
-        battery_info["voltage"] = (((data[9] & 255) * 256) + (data[10] & 255)) / 1000
-        battery_info["current"] = (((data[11] & 255) * 256) + (data[12] & 255)) / 1000
-        battery_info["capacity"] = (((data[13] & 255) * 256) + (data[14] & 255))
-        battery_info["temperature"] = data[15] & 255
-
-        resistance = ((data[16] & 255) * 256) + (data[17] & 255)
-        battery_info["resistance"] = "n/a" if resistance in [0, 1, 65535] else resistance
-
-        led = data[18] & 255
-        battery_info["led"] = self.resolve_led_color(led, battery_info["slot"])
-
-        return battery_info
+    def parse_battery_info(self, data):
+        (
+            _, _, slot, battery_type, mode, count, status, seconds, voltage, current, capacity, temperature,
+            resistance, led, _,
+        ) = self.BATTERY_INFO_FRAME.unpack_from(data)
+
+        return BatteryInfo(
+            slot,
+            self.types.get(battery_type, "unknown"),
+            self.mode_labels.get(battery_type, NO_MODES).get(mode, "unknown"),
+            count,
+            self.statuses.get(status, "unknown error"),
+            None,
+            seconds,
+            voltage / 1000,
+            current / 1000,
+            capacity,
+            temperature,
+            "n/a" if resistance in NO_RESISTANCE else resistance,
+            self.resolve_led_color(led, slot),
+        )
 
     def resolve_led_color(self, value, slot_index):
         def get_bit_value(bit):
@@ -176,17 +254,20 @@ class DebugPrint:
 
     def __init__(self, ble_address):
         self.service = MC3000Ble(ble_address=ble_address, interval=3)
+        self.service.sweep_callback = self.sweep_callback
 
     def run(self):
         self.service.run(self.receive_callback)
 
     def receive_callback(self, battery_info):
-        slot = battery_info["slot"]
-        self.buffer[slot] = battery_info
-        if slot == 3 and len(self.buffer) == 4:
-            for battery_info in self.buffer.values():
-                print(battery_info)
-            print()
+        battery_info = battery_info.to_dict()
+        self.buffer[battery_info["slot"]] = battery_info
+
+    def sweep_callback(self):
+        for slot in sorted(self.buffer):
+            print(self.buffer[slot])
+        print("sweep: %.3f s, latencies: %s" % (self.service.sweep_time or 0, self.service.sweep_latencies))
+        print()
 
 
 if __name__ == "__main__":
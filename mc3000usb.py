@@ -1,9 +1,14 @@
+import atexit
+import errno
 import json
+import logging
 import struct
 import sys
+import threading
 
 import usb.core
-from usb.core import USBError
+from usb.core import USBError, USBTimeoutError
+import usb.util
 
 from shared import calculate_checksum, compare_checksum
 
@@ -12,47 +17,164 @@ from shared import calculate_checksum, compare_checksum
 # https://github.com/gitGNU/gnu_dataexplorer/blob/master/SkyRC/src/gde/device/skyrc/MC3000UsbPort.java
 # https://github.com/gitGNU/gnu_dataexplorer/blob/master/SkyRC/src/gde/device/skyrc/MC3000.java
 class MC3000Usb:
+    """
+    USB connection of MC3000, shared by the whole process (`SESSION`).
+
+    The device is found once, its handle is cached with the interface claimed, so back-to-back operations
+    don't enumerate USB devices again. Every transfer has its own timeout. When the charger is unplugged
+    the handle is released and the next operation finds the device again - an operation failing on the stale
+    handle of a replugged charger is retried once with the new handle.
+    """
+
     VID = 0x0000
     PID = 0x0001
     ENDPOINT_OUT = 0x01
     ENDPOINT_IN = 0x81
     MESSAGE_SIZE = 64
-
-    def __init__(self):
+    INTERFACE = 0
+
+    # transfer timeouts (ms)
+    WRITE_TIMEOUT = 1000
+    READ_TIMEOUT = 2000
+
+    def __init__(self, find_device=None, write_timeout=WRITE_TIMEOUT, read_timeout=READ_TIMEOUT):
+        """
+        `find_device()` returns the device or None, `usb.core.find` by VID/PID is used by default.
+        """
+        self.find_device = find_device or self._find_device
+        self.write_timeout = write_timeout
+        self.read_timeout = read_timeout
         self.device = None
-        self.read_thread = None
-        self.running = None
+        self.detached = False
+        self.opened = 0
+        self.unplugged = 0
+        self.lock = threading.RLock()
+
+    def _find_device(self):
+        return usb.core.find(idVendor=self.VID, idProduct=self.PID)
 
     def open(self):
-        if self.device is None:
-            self.device = usb.core.find(idVendor=self.VID, idProduct=self.PID)
+        with self.lock:
+            if self.device is not None:
+                return self.device
 
-            if not self.device:
+            device = self.find_device()
+            if not device:
                 raise DeviceNotFoundException()
 
-            # MC3000 seems to be already configured by OS but pyusb says to always call set_configuration() so we will
             try:
-                self.device.get_active_configuration()  # will throw if not set
-            except USBError:
-                self.device.set_configuration()
+                # MC3000 seems to be already configured by OS but pyusb says to always call set_configuration()
+                try:
+                    device.get_active_configuration()  # will throw if not set
+                except USBError as e:
+                    if is_disconnected(e):
+                        raise
+                    device.set_configuration()
+
+                try:
+                    if device.is_kernel_driver_active(self.INTERFACE):
+                        device.detach_kernel_driver(self.INTERFACE)
+                        self.detached = True
+                except NotImplementedError:
+                    pass  # kernel drivers are a Linux thing
+
+                usb.util.claim_interface(device, self.INTERFACE)
+            except USBError as e:
+                self._dispose(device)
+                if is_disconnected(e):
+                    raise DeviceNotFoundException() from e
+                raise
+
+            self.device = device
+            self.opened += 1
+            logging.info("USB charger opened" if self.opened == 1 else "USB charger opened again after replug")
+            return device
 
-    def write(self, data):
-        self.open()
+    def close(self):
+        """
+        Releases the interface and the handle, the next operation opens the device again.
+        """
+        with self.lock:
+            device = self.device
+            if device is None:
+                return
+            self.device = None
+            try:
+                usb.util.release_interface(device, self.INTERFACE)
+                if self.detached:
+                    device.attach_kernel_driver(self.INTERFACE)
+            except (USBError, NotImplementedError) as e:
+                logging.debug("USB release failed: %s" % e)
+            finally:
+                self.detached = False
+                self._dispose(device)
+
+    def _dispose(self, device):
+        try:
+            usb.util.dispose_resources(device)
+        except USBError as e:
+            logging.debug("USB dispose failed: %s" % e)
 
+    def write(self, data, timeout=None):
+        data = list(data)
         while len(data) < self.MESSAGE_SIZE:
             data.append(0x00)
-
-        self.device.write(self.ENDPOINT_OUT, bytes(data))
-
-    def read(self, checksum=None):
-        self.open()
-        data = self.device.read(self.ENDPOINT_IN, self.MESSAGE_SIZE)
+        payload = bytes(data)
+        timeout = timeout or self.write_timeout
+        with self.lock:
+            self._transfer(lambda device: device.write(self.ENDPOINT_OUT, payload, timeout))
+
+    def read(self, checksum=None, timeout=None):
+        timeout = timeout or self.read_timeout
+        with self.lock:
+            # a reply can't be read again from the new handle, so the read alone isn't retried
+            data = self._transfer(lambda device: device.read(self.ENDPOINT_IN, self.MESSAGE_SIZE, timeout), False)
         if compare_checksum(data, checksum):
             raise ChecksumException(data)
         return data
 
-    def close(self):
-        self.running = False
+    def request(self, data, checksum=None):
+        """
+        Writes the request and reads its reply, the whole exchange is retried once after a replug.
+        """
+        with self.lock:
+            unplugged = self.unplugged
+            try:
+                self.write(data)
+                return self.read(checksum)
+            except DeviceNotFoundException:
+                if self.unplugged == unplugged:
+                    raise
+                self.write(data)
+                return self.read(checksum)
+
+    def _transfer(self, operation, retry=True):
+        """
+        Runs the operation with the open device, the lock must be held.
+        """
+        for attempt in range(2 if retry else 1):
+            device = self.open()
+            try:
+                return operation(device)
+            except USBTimeoutError as e:
+                raise TimeoutException() from e
+            except USBError as e:
+                if not is_disconnected(e):
+                    raise
+                self.unplugged += 1
+                logging.warning("USB charger disconnected: %s" % e)
+                self.close()
+        raise DeviceNotFoundException()
+
+
+def is_disconnected(error):
+    return error.errno in (errno.ENODEV, errno.EIO) or error.backend_error_code == LIBUSB_ERROR_NO_DEVICE
+
+
+LIBUSB_ERROR_NO_DEVICE = -4
+
+SESSION = MC3000Usb()
+atexit.register(SESSION.close)
 
 
 class Definitions:
@@ -381,12 +503,16 @@ class ChecksumException(MC3000UsbException):
     pass
 
 
+class TimeoutException(MC3000UsbException):
+    pass
+
+
 class JsonException(MC3000UsbException):
     pass
 
 
 if __name__ == "__main__":
-    coms = MC3000Usb()
+    coms = SESSION
     coms.open()
 
     encoder = MC3000Encoder()
@@ -395,8 +521,7 @@ if __name__ == "__main__":
     task = sys.argv[1] if len(sys.argv) > 1 else "save"
     if task == "save":
 
-        coms.write(encoder.prepare_slot_settings_read(0))
-        data = coms.read()
+        data = coms.request(encoder.prepare_slot_settings_read(0))
         slot = encoder.decode_slot_settings(data)
 
         with open(path, "w") as file:
@@ -1,13 +1,17 @@
 import asyncio
-from asyncio import Event
 import logging
+import struct
 import sys
-from time import time
+from time import monotonic
 
 from bleak import BleakClient
-import pendulum
 
-from shared import calculate_checksum
+from cadence import PollScheduler
+from metrics import ChargerMetrics
+from shared import RateLimitedLog, calculate_checksum
+from telemetry import BatteryInfo, NO_RESISTANCE, build_mode_labels
+
+NO_MODES = {}
 
 
 class MC5000Ble:
@@ -27,6 +31,18 @@ class MC5000Ble:
     HEADER = 0x0F  # 15
     SLOT_STATUS = 0x91  # 145
 
+    # response timeout is derived from smoothed round-trip time and its variation (SRTT + 4 * RTTVAR)
+    # and kept within these bounds
+    RESPONSE_TIMEOUT_MIN = 0.250
+    RESPONSE_TIMEOUT_MAX = 3
+
+    # shortest pause between polling rounds
+    POLL_WAIT_MIN = 0.010
+
+    # channel bitmask of requests and replies
+    slot_channels = (1, 2, 4, 8)
+    channel_slots = {1: 0, 2: 1, 4: 2, 8: 3}
+
     types = {
         0: "Li-ion",
         1: "Li-ion HV",
@@ -79,119 +95,194 @@ class MC5000Ble:
         13: "Fully charged",
     }
 
-    def __init__(self, ble_address, interval=1):
+    mode_labels = build_mode_labels(modes, modes_types_mapping)
+
+    # A fake LED emulation in the style of MC3000, since MC5000 has pulsing green for charging and solid
+    # green for charged - that's not very friendly, so we make red for charging and green for charged.
+    # Indexed by status, statuses above the table are green.
+    led_colors = ("none", "red", "red", "red", "red")
+
+    # header, length, command, channel, current, voltage, temperature, capacity, time, resistance, status, mode,
+    # error, type
+    SLOT_STATUS_FRAME = struct.Struct(">4B4HIH4B")
+
+    def __init__(self, ble_address, interval=1, client_factory=BleakClient, in_flight=1, name=None):
+        """
+        `in_flight` is the maximum number of slot requests sent before their replies arrive.
+        """
         self.ble_address = ble_address
         self.interval = interval
-        self.response_event = Event()
-        self.current_slot = None
+        self.client_factory = client_factory
+        self.in_flight = in_flight
+        self.device = None
+        # client of the latest connection attempt
+        self.client = None
+        self.disconnected_callback = None
+        self.metrics = ChargerMetrics(ble_address, name)
+        self.log = RateLimitedLog()
+        self.pending = {}
+        self.srtt = None
+        self.rttvar = None
+        self.scheduler = PollScheduler(interval)
+        self.sweep_latencies = []
+        self.sweep_time = None
         self.running = False
         self.receive_callback = None
 
     def run(self, receive_callback):
+        asyncio.run(self.run_async(receive_callback))
+
+    async def run_async(self, receive_callback):
         logging.info("service started")
         self.running = True
         self.receive_callback = receive_callback
-        asyncio.run(self._loop_async())
+        await self._loop_async()
 
     def stop(self):
         self.running = False
+        self.metrics.close()
         logging.info("service stopped")
 
+    def _disconnected(self, client):
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(client)
+
     async def _loop_async(self):
-        interval = float(self.interval)
-        begin = time()
-        slots = [1, 2, 4, 8]
-        async with BleakClient(self.ble_address) as client:
+        device = self.device if self.device is not None else self.ble_address
+        self.client = self.client_factory(device, disconnected_callback=self._disconnected)
+        async with self.client as client:
             await client.start_notify(self.CHARACTERISTIC_UUID, self._async_callback)
 
+            semaphore = asyncio.Semaphore(self.in_flight)
             while self.running:
-                for index, slot in enumerate(slots):
-                    self.response_event.clear()
-                    self.current_slot = index
-                    payload = self.create_payload_for_channel(slot, self.SLOT_STATUS)
-                    await client.write_gatt_char(self.CHARACTERISTIC_UUID, payload)
+                sweep_begin = monotonic()
+                slots = self.scheduler.due(sweep_begin)
+                if slots:
+                    latencies = await asyncio.gather(*[
+                        self._request_slot(client, slot, semaphore) for slot in slots
+                    ])
 
-                    try:
-                        await asyncio.wait_for(self.response_event.wait(), timeout=3)
-                    except asyncio.TimeoutError:
-                        continue
+                    self.sweep_latencies = latencies
+                    self.sweep_time = monotonic() - sweep_begin
+                    logging.debug("sweep done in %.3f s, slot latencies: %s" % (self.sweep_time, latencies))
+                    self.sweep_callback()
 
-                await asyncio.sleep(interval - ((time() - begin) % interval))
+                await asyncio.sleep(max(self.scheduler.wait(), self.POLL_WAIT_MIN))
 
             await client.stop_notify(self.CHARACTERISTIC_UUID)
 
+    async def _request_slot(self, client, slot, semaphore):
+        """
+        Sends the request for given slot and waits until the reply with the same channel arrives.
+        Returns request -> reply latency in seconds or None when the reply timed out.
+        """
+        async with semaphore:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[slot] = future
+            sent = monotonic()
+            try:
+                payload = self.create_payload_for_channel(self.slot_channels[slot], self.SLOT_STATUS)
+                await client.write_gatt_char(self.CHARACTERISTIC_UUID, payload)
+                await asyncio.wait_for(future, timeout=self.get_response_timeout())
+            except asyncio.TimeoutError:
+                self.metrics.observe_missed(slot)
+                logging.debug("response for slot %s timed out" % slot)
+                return None
+            finally:
+                if self.pending.get(slot) is future:
+                    del self.pending[slot]
+                self.scheduler.polled(slot)
+
+        latency = monotonic() - sent
+        self.metrics.observe_reply(slot, latency)
+        self.update_round_trip_time(latency)
+        return latency
+
+    def update_round_trip_time(self, latency):
+        if self.srtt is None:
+            self.srtt = latency
+            self.rttvar = latency / 2
+        else:
+            self.rttvar += (abs(self.srtt - latency) - self.rttvar) / 4
+            self.srtt += (latency - self.srtt) / 8
+
+    def get_response_timeout(self):
+        if self.srtt is None:
+            return self.RESPONSE_TIMEOUT_MAX
+        timeout = self.srtt + 4 * self.rttvar
+        return min(max(timeout, self.RESPONSE_TIMEOUT_MIN), self.RESPONSE_TIMEOUT_MAX)
+
     async def _async_callback(self, sender, data):
         self.raw_receive_callback(data)
+        self.metrics.notifications.inc()
 
         expected = calculate_checksum(data[2:-1])
         if expected != data[-1]:
-            logging.warning("checksum check failed, expected: %s, got: %s, payload: %s" % (
+            self.metrics.checksum_failures.inc()
+            self.log.warning("checksum", "checksum check failed, expected: %s, got: %s, payload: %s" % (
                 expected, data[-1], data,
             ))
             return
 
         if data[2] == self.SLOT_STATUS:
+            # a reply without a valid channel bitmask can't be matched to a slot nor a request
+            if data[3] not in self.channel_slots:
+                self.metrics.unsolicited.inc()
+                self.log.warning("channel", "reply with invalid channel bitmask %s, payload: %s" % (data[3], data))
+                return
+
             battery_info = self.parse_battery_info(data)
+            self.metrics.observe(battery_info)
+            self.scheduler.observe(battery_info)
             if self.receive_callback:
                 callback = self.receive_callback
                 # noinspection PyCallingNonCallable
                 callback(battery_info)
 
-        self.response_event.set()
+            # late replies (after their request timed out) are delivered but complete no request
+            future = self.pending.get(battery_info.slot)
+            if future is not None and not future.done():
+                future.set_result(None)
+            else:
+                self.metrics.unsolicited.inc()
 
     def raw_receive_callback(self, data):
         pass  # virtual
 
-    def parse_battery_info(self, data):
-        battery_info: dict = {
-            "slot": self.current_slot,
-        }
-
-        battery_type = data[21]
-        battery_info["type"] = self.types.get(battery_type, "unknown")
-
-        available_modes = []
-        for mode_group, applicable_types in self.modes_types_mapping.items():
-            if battery_type in applicable_types:
-                available_modes = self.modes[mode_group]
-                break
-
-        mode = data[19]
-        battery_info["mode"] = available_modes.get(mode, "unknown")
-
-        status = data[18]
-        battery_info["status"] = self.statuses.get(status, "unknown")
-
-        error = data[20]
-        battery_info["error"] = self.errors.get(error, "ERROR")
+    def sweep_callback(self):
+        pass  # virtual, called after every polling round
 
-        battery_info["voltage"] = int.from_bytes(data[6:8], byteorder="big") / 1000
-        battery_info["current"] = int.from_bytes(data[4:6], byteorder="big") / 1000
-        battery_info["capacity"] = int.from_bytes(data[10:12], byteorder="big")
-        battery_info["temperature"] = int.from_bytes(data[8:10], byteorder="big") / 1000
-        if battery_info["temperature"] < 1:
-            battery_info["temperature"] = 0
-
-        seconds = int.from_bytes(data[12:16], byteorder="big")
-        battery_info["time"] = pendulum.duration(seconds=seconds)
-
-        resistance = int.from_bytes(data[16:18], byteorder="big")
-        battery_info["resistance"] = "n/a" if resistance in [0, 1, 65535] else resistance
-
-        # A fake LED emulation in the style of MC3000, since MC5000 has pulsing green for charging and solid
-        # green for charged - that's not very friendly, so we make red for charging and green for charged.
-        led_color = "none"
-        if status >= 1 and status <= 4:
-            led_color = "red"
-        elif status >= 5:
-            led_color = "green"
-        battery_info["led"] = led_color
+    def parse_battery_info(self, data):
+        (
+            _, _, _, _, current, voltage, temperature, capacity, seconds, resistance, status, mode, error, battery_type,
+        ) = self.SLOT_STATUS_FRAME.unpack_from(data)
 
-        # Override status with error to error in the style of MC3000
+        error_label = self.errors.get(error, "ERROR")
         if error > 0:
-            battery_info["status"] = battery_info["error"]
-
-        return battery_info
+            # Override status with error to error in the style of MC3000
+            status_label = error_label
+        else:
+            status_label = self.statuses.get(status, "unknown")
+
+        temperature = temperature / 1000
+        if temperature < 1:
+            temperature = 0
+
+        return BatteryInfo(
+            self.channel_slots[data[3]],
+            self.types.get(battery_type, "unknown"),
+            self.mode_labels.get(battery_type, NO_MODES).get(mode, "unknown"),
+            None,
+            status_label,
+            error_label,
+            seconds,
+            voltage / 1000,
+            current / 1000,
+            capacity,
+            temperature,
+            "n/a" if resistance in NO_RESISTANCE else resistance,
+            self.led_colors[status] if status < len(self.led_colors) else "green",
+        )
 
     def create_payload_for_channel(self, channel, command):
         data = [
@@ -216,18 +307,20 @@ class DebugPrint:
             3: None,
         }
         self.service = MC5000Ble(ble_address=ble_address, interval=3)
+        self.service.sweep_callback = self.sweep_callback
         # self.service.raw_receive_callback = self.raw_receive_callback
 
     def run(self):
         self.service.run(self.receive_callback)
 
     def receive_callback(self, battery_info):
-        slot = battery_info["slot"]
-        self.buffer[slot] = battery_info
-        if slot == 3:
-            for battery_info in self.buffer.values():
-                print(battery_info)
-            print()
+        battery_info = battery_info.to_dict()
+        self.buffer[battery_info["slot"]] = battery_info
+
+    def sweep_callback(self):
+        for battery_info in self.buffer.values():
+            print(battery_info)
+        print()
 
     def raw_receive_callback(self, data):
         print("%s (%s)" % (" ".join(f"0x{b:02X}" for b in data), len(data)))
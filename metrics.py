@@ -0,0 +1,328 @@
+"""
+Minimal Prometheus text exposition of charger telemetry and link health.
+
+Values are updated incrementally in the decode path (every metric child is a plain object with a float value),
+a scrape only formats the current values.
+"""
+
+from bisect import bisect_left
+import math
+import threading
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = math.nan
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, `counts[i]` counts observations <= `bounds[i]` (not cumulative),
+    the last count is the +Inf bucket.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket containing given quantile, None without observations
+        and infinity when it falls into the +Inf bucket.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return self.bounds[index] if index < len(self.bounds) else math.inf
+        return math.inf
+
+
+class Family:
+    def __init__(self, name, help, type, labelnames, buckets=None):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        Child metric for given label values, keep the returned object to avoid the lookup in hot paths.
+        """
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    if self.type == "histogram":
+                        child = Histogram(self.buckets)
+                    elif self.type == "counter":
+                        child = Counter()
+                    else:
+                        child = Gauge()
+                    self.children[values] = child
+        return child
+
+    def remove(self, prefix):
+        """
+        Removes children whose label values start with `prefix`.
+        """
+        prefix = tuple(str(value) for value in prefix)
+        with self.lock:
+            for values in [values for values in self.children if values[:len(prefix)] == prefix]:
+                del self.children[values]
+
+    def render(self, lines):
+        lines.append("# HELP %s %s" % (self.name, self.help))
+        lines.append("# TYPE %s %s" % (self.name, self.type))
+        for values, child in list(self.children.items()):
+            labels = ",".join('%s="%s"' % (name, escape(value)) for name, value in zip(self.labelnames, values))
+            if self.type == "histogram":
+                self.render_histogram(lines, labels, child)
+            else:
+                lines.append("%s{%s} %s" % (self.name, labels, format_value(child.value)))
+
+    def render_histogram(self, lines, labels, histogram):
+        total = 0
+        bounds = [format_bound(bound) for bound in histogram.bounds + (math.inf,)]
+        for bound, count in zip(bounds, histogram.counts):
+            total += count
+            lines.append('%s_bucket{%s,le="%s"} %s' % (self.name, labels, bound, total))
+        lines.append("%s_sum{%s} %s" % (self.name, labels, format_value(histogram.sum)))
+        lines.append("%s_count{%s} %s" % (self.name, labels, histogram.count))
+
+
+class Registry:
+    def __init__(self):
+        self.families = []
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Family(name, help, "counter", labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Family(name, help, "gauge", labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=()):
+        return self.register(Family(name, help, "histogram", labelnames, tuple(buckets)))
+
+    def register(self, family):
+        self.families.append(family)
+        return family
+
+    def remove(self, prefix):
+        for family in self.families:
+            family.remove(prefix)
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            family.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def format_bound(value):
+    if value is None:
+        return None
+    return format_value(float(value))
+
+
+REGISTRY = Registry()
+
+# BLE address and the fleet charger name
+CHARGER_LABELS = ["charger", "name"]
+SLOT_LABELS = CHARGER_LABELS + ["slot"]
+
+NOTIFICATIONS = REGISTRY.counter(
+    "mc_notifications_total", "BLE notifications received from the charger", CHARGER_LABELS
+)
+CHECKSUM_FAILURES = REGISTRY.counter(
+    "mc_checksum_failures_total", "BLE notifications dropped due to checksum mismatch", CHARGER_LABELS
+)
+RESPONSE_TIMEOUTS = REGISTRY.counter(
+    "mc_response_timeouts_total", "Slot requests not answered within the response timeout", CHARGER_LABELS
+)
+RECONNECTS = REGISTRY.counter(
+    "mc_reconnects_total", "Reconnects after the BLE connection failed", CHARGER_LABELS
+)
+DISCONNECTS = REGISTRY.counter(
+    "mc_disconnects_total", "BLE disconnects reported by the adapter or detected as stalled updates", CHARGER_LABELS
+)
+RECONNECT_SECONDS = REGISTRY.counter(
+    "mc_reconnect_seconds_total", "Total time from losing the connection to the first frame after reconnect",
+    CHARGER_LABELS
+)
+LAST_RECONNECT_SECONDS = REGISTRY.gauge(
+    "mc_last_reconnect_seconds", "Time from losing the connection to the first frame of the last reconnect",
+    CHARGER_LABELS
+)
+UNSOLICITED = REGISTRY.counter(
+    "mc_unsolicited_notifications_total", "Notifications not answering a pending request (late or unexpected)",
+    CHARGER_LABELS
+)
+RTT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SLOT_RTT = REGISTRY.histogram(
+    "mc_slot_rtt_seconds", "Slot request to notification round-trip time", SLOT_LABELS, RTT_BUCKETS
+)
+SLOT_MISSED = REGISTRY.counter(
+    "mc_slot_missed_replies_total", "Slot requests without a reply within the response timeout", SLOT_LABELS
+)
+CONNECTED = REGISTRY.gauge("mc_connected", "1 when the charger is connected and sending frames", CHARGER_LABELS)
+VOLTAGE = REGISTRY.gauge("mc_slot_voltage_volts", "Slot voltage", SLOT_LABELS)
+CURRENT = REGISTRY.gauge("mc_slot_current_amperes", "Slot current", SLOT_LABELS)
+CAPACITY = REGISTRY.gauge("mc_slot_capacity_mah", "Slot capacity", SLOT_LABELS)
+TEMPERATURE = REGISTRY.gauge("mc_slot_temperature_celsius", "Slot temperature", SLOT_LABELS)
+RESISTANCE = REGISTRY.gauge("mc_slot_resistance_milliohms", "Slot internal resistance, NaN when n/a",
+                            SLOT_LABELS)
+
+
+# ChargerMetrics by charger, for the diagnostics page
+CHARGERS = {}
+
+
+class ChargerMetrics:
+    """
+    Metric children of one charger resolved once, so the decode path only sets attributes.
+    """
+
+    def __init__(self, charger, name=None):
+        """
+        `charger` is the BLE address, `name` the fleet charger name (as in `/state`, `/stream` and the sessions),
+        empty for the single charger monitors.
+        """
+        CHARGERS[charger] = self
+        self.charger = charger
+        self.name = name if name is not None else ""
+        labels = (charger, self.name)
+        self.notifications = NOTIFICATIONS.labels(*labels)
+        self.checksum_failures = CHECKSUM_FAILURES.labels(*labels)
+        self.response_timeouts = RESPONSE_TIMEOUTS.labels(*labels)
+        self.reconnects = RECONNECTS.labels(*labels)
+        self.disconnects = DISCONNECTS.labels(*labels)
+        self.reconnect_seconds = RECONNECT_SECONDS.labels(*labels)
+        self.last_reconnect_seconds = LAST_RECONNECT_SECONDS.labels(*labels)
+        self.connected = CONNECTED.labels(*labels)
+        self.unsolicited = UNSOLICITED.labels(*labels)
+        self.slots = {}
+        self.links = {}
+
+    def close(self):
+        """
+        Unregisters the charger when its service stops, its series are no longer exported. A newer instance
+        of the same charger (the service was replaced) is left alone.
+        """
+        if CHARGERS.get(self.charger) is self:
+            del CHARGERS[self.charger]
+            REGISTRY.remove((self.charger, self.name))
+
+    def get_link(self, slot):
+        """
+        (RTT histogram, missed replies counter) of given slot.
+        """
+        link = self.links.get(slot)
+        if link is None:
+            link = self.links[slot] = (
+                SLOT_RTT.labels(self.charger, self.name, slot), SLOT_MISSED.labels(self.charger, self.name, slot),
+            )
+        return link
+
+    def observe_reply(self, slot, latency):
+        self.get_link(slot)[0].observe(latency)
+
+    def observe_missed(self, slot):
+        self.response_timeouts.inc()
+        self.get_link(slot)[1].inc()
+
+    def get_link_report(self):
+        """
+        Link quality of the charger and its slots for the diagnostics page.
+        """
+        slots = []
+        for slot, (rtt, missed) in sorted(self.links.items()):
+            requests = rtt.count + missed.value
+            slots.append({
+                "slot": slot,
+                "replies": rtt.count,
+                "missed": missed.value,
+                "loss": missed.value / requests if requests else 0,
+                "rtt_avg": rtt.sum / rtt.count if rtt.count else None,
+                # upper bounds of the buckets containing the percentiles
+                "rtt_p50": format_bound(rtt.quantile(0.5)),
+                "rtt_p90": format_bound(rtt.quantile(0.9)),
+                "rtt_p99": format_bound(rtt.quantile(0.99)),
+                "buckets": list(zip([format_bound(bound) for bound in rtt.bounds + (math.inf,)], rtt.counts)),
+            })
+        return {
+            "charger": self.charger,
+            "name": self.name,
+            "connected": self.connected.value == 1,
+            "notifications": self.notifications.value,
+            "checksum_failures": self.checksum_failures.value,
+            "unsolicited": self.unsolicited.value,
+            "response_timeouts": self.response_timeouts.value,
+            "disconnects": self.disconnects.value,
+            "reconnects": self.reconnects.value,
+            "slots": slots,
+        }
+
+    def observe(self, battery_info):
+        gauges = self.slots.get(battery_info.slot)
+        if gauges is None:
+            slot = battery_info.slot
+            gauges = self.slots[slot] = (
+                VOLTAGE.labels(self.charger, self.name, slot),
+                CURRENT.labels(self.charger, self.name, slot),
+                CAPACITY.labels(self.charger, self.name, slot),
+                TEMPERATURE.labels(self.charger, self.name, slot),
+                RESISTANCE.labels(self.charger, self.name, slot),
+            )
+        voltage, current, capacity, temperature, resistance = gauges
+        voltage.value = battery_info.voltage
+        current.value = battery_info.current
+        capacity.value = battery_info.capacity
+        temperature.value = battery_info.temperature
+        resistance.value = battery_info.resistance if isinstance(battery_info.resistance, int) else math.nan
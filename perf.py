@@ -0,0 +1,146 @@
+"""
+Optional timing of the stages between a BLE notification and the UI push.
+
+Disabled instrumentation costs nothing - stages are timed by wrapping their functions (`instrument`) only while
+enabled and the originals are put back by `disable`, so the hot path is never touched when off. Every stage
+keeps the last `size` durations (monotonic clock) in a fixed ring buffer, percentiles are computed from it
+only when a report is requested.
+"""
+
+from array import array
+import asyncio
+import functools
+import json
+import threading
+from time import monotonic, time
+
+# samples kept per stage
+SIZE = 1024
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class StageTimes:
+    __slots__ = ("samples", "index", "count", "total", "maximum")
+
+    def __init__(self, size=SIZE):
+        self.samples = array("d", bytes(8 * size))
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        samples = self.samples
+        samples[self.index] = seconds
+        self.index = (self.index + 1) % len(samples)
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def to_dict(self):
+        """
+        Count, mean and maximum over all samples, percentiles over the samples in the buffer, times in ms.
+        """
+        recent = sorted(self.samples[:min(self.count, len(self.samples))])
+        result = {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else None,
+            "max_ms": self.maximum * 1000,
+        }
+        for quantile in QUANTILES:
+            key = "p%s_ms" % int(quantile * 100)
+            result[key] = recent[min(int(quantile * len(recent)), len(recent) - 1)] * 1000 if recent else None
+        return result
+
+
+class Recorder:
+    def __init__(self, size=SIZE):
+        self.size = size
+        self.enabled = False
+        self.enabled_at = None
+        self.stages = {}
+        # (owner, name, stage) to wrap when enabled, and the originals while they are wrapped
+        self.instruments = []
+        self.originals = []
+        self.lock = threading.Lock()
+
+    def instrument(self, owner, name, stage):
+        """
+        Times every call of `owner.name` (a plain function or method of a class, instance or module,
+        also a coroutine function) as `stage` while enabled.
+        """
+        if any(entry[0] is owner and entry[1] == name for entry in self.instruments):
+            return
+        self.instruments.append((owner, name, stage))
+        if self.enabled:
+            self._wrap(owner, name, stage)
+
+    def enable(self):
+        with self.lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            self.enabled_at = time()
+            for owner, name, stage in self.instruments:
+                self._wrap(owner, name, stage)
+
+    def disable(self):
+        with self.lock:
+            self.enabled = False
+            while self.originals:
+                owner, name, original, present = self.originals.pop()
+                if present:
+                    setattr(owner, name, original)
+                else:
+                    delattr(owner, name)
+
+    def reset(self):
+        self.stages = {}
+
+    def _wrap(self, owner, name, stage):
+        present = name in vars(owner)
+        function = getattr(owner, name)
+        record = self.record
+
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*arguments, **kwargs):
+                begin = monotonic()
+                try:
+                    return await function(*arguments, **kwargs)
+                finally:
+                    record(stage, monotonic() - begin)
+        else:
+            @functools.wraps(function)
+            def timed(*arguments, **kwargs):
+                begin = monotonic()
+                try:
+                    return function(*arguments, **kwargs)
+                finally:
+                    record(stage, monotonic() - begin)
+
+        self.originals.append((owner, name, vars(owner).get(name), present))
+        setattr(owner, name, timed)
+
+    def record(self, stage, seconds):
+        times = self.stages.get(stage)
+        if times is None:
+            times = self.stages[stage] = StageTimes(self.size)
+        times.add(seconds)
+
+    def report(self):
+        return {
+            "enabled": self.enabled,
+            "enabled_at": self.enabled_at,
+            "size": self.size,
+            "stages": {stage: times.to_dict() for stage, times in sorted(list(self.stages.items()))},
+        }
+
+    def dump(self, path):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=True)
+
+
+PERF = Recorder()
@@ -8,13 +8,14 @@ import webview
 from werkzeug.exceptions import NotFound
 
 from config import Config
-from mc3000usb import MC3000Usb, MC3000Encoder, DeviceNotFoundException, SlotSettings
+from mc3000usb import MC3000Encoder, DeviceNotFoundException, SESSION, SlotSettings, TimeoutException
 
 
 class ProfilesController:
-    def __init__(self, server, config):
+    def __init__(self, server, config, usb=SESSION):
         self.server = server
         self.config = config
+        self.usb = usb
         self.storage = Config(name="profiles.json")
         self.memory = {}
 
@@ -87,12 +88,10 @@ class ProfilesController:
             return redirect(url_for("profiles_list"))
 
         try:
-            coms = MC3000Usb()
             encoder = MC3000Encoder()
             profiles = []
             for slot in range(0, 4):
-                coms.write(encoder.prepare_slot_settings_read(slot))
-                data = coms.read()
+                data = self.usb.request(encoder.prepare_slot_settings_read(slot))
                 profile = encoder.decode_slot_settings(data)
                 profile.id = self.generate_id()
                 profiles.append(profile)
@@ -182,13 +181,12 @@ class ProfilesController:
             except (TypeError, ValueError):
                 selected_slot = None
 
-            coms = MC3000Usb()
             encoder = MC3000Encoder()
             for slot in range(0, 4):
                 if selected_slot is not None and selected_slot != slot:
                     continue
                 profile.slot_number = slot
-                coms.write(encoder.prepare_slot_settings_write(profile))
+                self.usb.write(encoder.prepare_slot_settings_write(profile))
 
             if selected_slot is None:
                 message = "Profile '%s' was successfully set to all slots" % profile.get_description(True)
@@ -230,6 +228,8 @@ class ProfilesController:
         suffix = "make sure you charger is connected via USB and driver is working"
         if isinstance(e, DeviceNotFoundException):
             return "Charger not found, %s" % suffix
+        elif isinstance(e, TimeoutException):
+            return "Charger didn't respond in time, %s" % suffix
         else:
             logging.exception(e)
             return "Unexpected error occurred: %s, %s" % (e, suffix)
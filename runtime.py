@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+
+from ntdrt.threads import SafeThread
+
+
+class Runtime:
+    """
+    One long-lived event loop on a dedicated thread, owning all BLE work (scanning, connections, polling
+    and the connection watchdog). Other threads (Flask handlers, the window) only submit coroutines
+    and callbacks through the thread-safe methods below, nothing else touches the loop.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = SafeThread(target=self._run, daemon=True)
+            self.thread.start()
+            self.ready.wait()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        self.ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            try:
+                tasks = asyncio.all_tasks(loop)
+                for task in tasks:
+                    task.cancel()
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                loop.close()
+                logging.info("runtime stopped")
+
+    def submit(self, coroutine):
+        """
+        Schedules the coroutine on the runtime loop, returns `concurrent.futures.Future` of its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, coroutine, timeout=None):
+        """
+        Runs the coroutine on the runtime loop and blocks the calling thread until it's done.
+        Must not be called from the runtime thread itself.
+        """
+        return self.submit(coroutine).result(timeout)
+
+    def call_soon(self, callback, *arguments):
+        self.loop.call_soon_threadsafe(callback, *arguments)
+
+    def call_later(self, delay, callback, *arguments):
+        """
+        Calls the callback on the runtime loop after `delay` seconds, can be called from any thread.
+        The returned handle can be cancelled from any thread as well.
+        """
+        handle = DelayedCall(callback, arguments)
+        if self.is_runtime_thread():
+            self.loop.call_later(delay, handle.run)
+        else:
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay, handle.run)
+        return handle
+
+    def is_runtime_thread(self):
+        return self.thread is not None and threading.current_thread() is self.thread
+
+    def stop(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None and not self.is_runtime_thread():
+            self.thread.join()
+        self.thread = None
+
+
+class DelayedCall:
+    """
+    Handle of `Runtime.call_later` - a cancelled call stays scheduled on the loop but doesn't run the callback.
+    """
+
+    def __init__(self, callback, arguments):
+        self.callback = callback
+        self.arguments = arguments
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if not self.cancelled:
+            self.callback(*self.arguments)
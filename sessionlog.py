@@ -0,0 +1,295 @@
+"""
+SQLite log of every decoded frame.
+
+The BLE callback only puts a tuple into a bounded queue, a background writer thread drains the queue and inserts
+frames in batches within one transaction. The database runs in WAL mode, so readers (the query API) don't block
+the writer and vice versa. A failed batch (e.g. the database locked by another monitor process) is retried
+on a new connection with backoff, the writer never gives up - frames are only dropped (counted and logged)
+when a batch fails every retry or the queue is full.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+from time import sleep, time
+
+from ntdrt.threads import SafeThread
+
+import config
+from shared import RateLimitedLog
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS frames (
+        charger TEXT NOT NULL,
+        slot INTEGER NOT NULL,
+        timestamp REAL NOT NULL,
+        type TEXT,
+        mode TEXT,
+        status TEXT,
+        seconds INTEGER,
+        voltage REAL,
+        current REAL,
+        capacity INTEGER,
+        temperature REAL,
+        resistance INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS frames_charger_slot_timestamp ON frames (charger, slot, timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS summaries (
+        charger TEXT NOT NULL,
+        slot INTEGER NOT NULL,
+        started REAL NOT NULL,
+        finished REAL NOT NULL,
+        status TEXT,
+        summary TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS summaries_charger_slot_started ON summaries (charger, slot, started)",
+]
+
+INSERT = "INSERT INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+INSERT_SUMMARY = "INSERT INTO summaries VALUES (?, ?, ?, ?, ?, ?)"
+
+STOP = None
+
+
+class Summary(tuple):
+    """
+    Row of the summaries table, queued together with frame rows and told apart by type.
+    """
+
+
+class SessionLog:
+    # attempts of writing a batch, the delay between them doubles from RETRY_DELAY seconds
+    RETRIES = 5
+    RETRY_DELAY = 0.5
+
+    def __init__(self, path=None, batch_size=1000, flush_interval=1, queue_size=100000, default_charger="default"):
+        """
+        Frames without a charger (single charger monitors) are logged as `default_charger` - the MC3000
+        and MC5000 monitors share the database, so each uses its model.
+        """
+        self.path = path or os.path.join(config.data_dir, "sessions.sqlite")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.default_charger = default_charger
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.dropped = 0
+        self.written = 0
+        self.log = RateLimitedLog()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = SafeThread(target=self._writer, daemon=True)
+            self.thread.start()
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(STOP)
+            self.thread.join()
+            self.thread = None
+
+    def append(self, battery_info, charger=None, timestamp=None):
+        """
+        Never blocks - when the writer can't keep up and the queue is full the frame is dropped.
+        """
+        resistance = battery_info.resistance
+        try:
+            self.queue.put_nowait((
+                charger if charger is not None else self.default_charger,
+                battery_info.slot,
+                timestamp if timestamp is not None else time(),
+                battery_info.type,
+                battery_info.mode,
+                battery_info.status,
+                battery_info.seconds,
+                battery_info.voltage,
+                battery_info.current,
+                battery_info.capacity,
+                battery_info.temperature,
+                resistance if isinstance(resistance, int) else None,
+            ))
+        except queue.Full:
+            self._dropped(1)
+
+    def append_summary(self, summary):
+        """
+        Finished session summary of `sessions.SessionTracker`, written by the writer thread as well.
+        """
+        try:
+            self.queue.put_nowait(Summary((
+                summary["charger"] if summary["charger"] is not None else self.default_charger,
+                summary["slot"],
+                summary["started"],
+                summary["finished"],
+                summary["status"],
+                json.dumps(summary),
+            )))
+        except queue.Full:
+            self._dropped(1)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _writer(self):
+        connection = None
+        running = True
+        while running:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch = []
+            summaries = []
+            while True:
+                if item is STOP:
+                    running = False
+                    break
+                if isinstance(item, Summary):
+                    summaries.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch or summaries:
+                connection = self._write(connection, batch, summaries)
+
+        if connection is not None:
+            connection.close()
+
+    def _write(self, connection, batch, summaries):
+        """
+        Writes one batch within a transaction and returns the connection for the next one. Every failed attempt
+        closes the connection and the next one reconnects, after `RETRIES` attempts the batch is dropped.
+        """
+        for attempt in range(self.RETRIES):
+            try:
+                if connection is None:
+                    connection = self.connect()
+                    for statement in SCHEMA:
+                        connection.execute(statement)
+                    connection.commit()
+                with connection:
+                    connection.executemany(INSERT, batch)
+                    connection.executemany(INSERT_SUMMARY, summaries)
+                self.written += len(batch)
+                return connection
+            except sqlite3.Error as e:
+                self.log.warning("error", "session log write failed (attempt %s of %s): %s" % (
+                    attempt + 1, self.RETRIES, e,
+                ))
+                if connection is not None:
+                    connection.close()
+                    connection = None
+                if attempt + 1 < self.RETRIES:
+                    sleep(self.RETRY_DELAY * 2 ** attempt)
+        self._dropped(len(batch) + len(summaries))
+        return None
+
+    def _dropped(self, count):
+        self.dropped += count
+        self.log.warning("dropped", "session log dropped %s frames, %s in total" % (count, self.dropped))
+
+    def query(self, sql, parameters=()):
+        connection = self.connect()
+        try:
+            connection.row_factory = sqlite3.Row
+            return [dict(row) for row in connection.execute(sql, parameters)]
+        finally:
+            connection.close()
+
+    def chargers(self):
+        return [row["charger"] for row in self.query("SELECT DISTINCT charger FROM frames ORDER BY charger")]
+
+    def frames(self, charger, slot, start=None, end=None, limit=10000):
+        sql = "SELECT * FROM frames WHERE charger = ? AND slot = ? AND timestamp >= ? AND timestamp < ?" \
+              " ORDER BY timestamp LIMIT ?"
+        return self.query(sql, (
+            charger, slot, start if start is not None else 0, end if end is not None else float("inf"), limit,
+        ))
+
+    def sessions(self, charger=None, slot=None, start=None, end=None, gap=300):
+        """
+        Past sessions - runs of frames not in Standby, a session ends with Standby or a gap longer than `gap`
+        seconds between frames. Returns charger, slot, started, finished, frames, capacity (max), voltage min/max,
+        temperature max and the last status.
+        """
+        conditions = ["1"]
+        parameters = []
+        if charger is not None:
+            conditions.append("charger = ?")
+            parameters.append(charger)
+        if slot is not None:
+            conditions.append("slot = ?")
+            parameters.append(slot)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("timestamp < ?")
+            parameters.append(end)
+
+        sql = """
+            WITH marked AS (
+                SELECT *, CASE
+                    WHEN LAG(status) OVER slot_window = 'Standby' THEN 1
+                    WHEN timestamp - LAG(timestamp) OVER slot_window > ? THEN 1
+                    ELSE 0
+                END AS begins
+                FROM frames
+                WHERE %s
+                WINDOW slot_window AS (PARTITION BY charger, slot ORDER BY timestamp)
+            ),
+            grouped AS (
+                SELECT *, SUM(begins) OVER (PARTITION BY charger, slot ORDER BY timestamp) AS session FROM marked
+            ),
+            active AS (
+                SELECT *, ROW_NUMBER() OVER (
+                    PARTITION BY charger, slot, session ORDER BY timestamp DESC
+                ) AS from_end
+                FROM grouped
+                WHERE status != 'Standby'
+            )
+            SELECT
+                charger, slot, MIN(timestamp) AS started, MAX(timestamp) AS finished, COUNT(*) AS frames,
+                MAX(capacity) AS capacity, MIN(voltage) AS voltage_min, MAX(voltage) AS voltage_max,
+                MAX(temperature) AS temperature_max, MAX(CASE WHEN from_end = 1 THEN status END) AS status
+            FROM active
+            GROUP BY charger, slot, session
+            ORDER BY started
+        """ % " AND ".join(conditions)
+        return self.query(sql, [gap] + parameters)
+
+    def summaries(self, charger=None, slot=None, start=None, end=None, limit=1000):
+        """
+        Persisted summaries of finished sessions (see `sessions.Session.to_dict`), newest first.
+        """
+        conditions = ["1"]
+        parameters = []
+        if charger is not None:
+            conditions.append("charger = ?")
+            parameters.append(charger)
+        if slot is not None:
+            conditions.append("slot = ?")
+            parameters.append(slot)
+        if start is not None:
+            conditions.append("started >= ?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append("started < ?")
+            parameters.append(end)
+        sql = "SELECT summary FROM summaries WHERE %s ORDER BY started DESC LIMIT ?" % " AND ".join(conditions)
+        return [json.loads(row["summary"]) for row in self.query(sql, parameters + [limit])]
@@ -0,0 +1,201 @@
+"""
+Streaming detection of charge sessions.
+
+A session starts when a slot leaves Standby for one of the active statuses (Charging, Discharging, ...) and ends
+with any other status - Completed, an error, or Standby when the battery was removed or the program stopped.
+Aggregates are updated incrementally, every frame costs O(1) time and a running session takes constant memory
+regardless of its length.
+"""
+
+from collections import deque
+import threading
+from time import time
+
+ACTIVE_STATUSES = frozenset(["Charging", "Discharging", "Processing", "Resting", "Pause"])
+
+# statuses starting a phase of their own, the other active statuses (a pause, the rest between cycles)
+# continue the current phase
+PHASE_STATUSES = frozenset(["Charging", "Discharging"])
+
+# frames further apart than this many seconds are not integrated into energy (connection was lost meanwhile)
+INTEGRATION_GAP_MAX = 60
+
+
+class Session:
+    def __init__(self, charger, slot, timestamp, battery_info):
+        self.charger = charger
+        self.slot = slot
+        self.started = timestamp
+        self.finished = None
+        self.type = battery_info.type
+        self.mode = battery_info.mode
+        self.status = battery_info.status
+        self.end_status = None
+        self.frames = 0
+
+        self.phase = None
+        self.phase_capacity = 0
+        self.charge_mah = 0
+        self.discharge_mah = 0
+        self.charge_wh = 0.0
+        self.discharge_wh = 0.0
+
+        self.voltage_start = battery_info.voltage
+        self.voltage_end = battery_info.voltage
+        self.temperature_min = None
+        self.temperature_max = None
+        self.temperature_sum = 0.0
+        self.resistance_samples = 0
+        self.resistance_min = None
+        self.resistance_max = None
+        self.resistance_sum = 0
+
+        self.last_timestamp = None
+        self.last_power = None
+
+    def update(self, timestamp, battery_info):
+        status = battery_info.status
+        self.status = status
+        self.frames += 1
+
+        if status in PHASE_STATUSES and status != self.phase:
+            self._finish_phase()
+            self.phase = status
+        if battery_info.capacity > self.phase_capacity:
+            self.phase_capacity = battery_info.capacity
+
+        power = battery_info.voltage * abs(battery_info.current)
+        if self.last_timestamp is not None:
+            elapsed = timestamp - self.last_timestamp
+            if 0 < elapsed <= INTEGRATION_GAP_MAX:
+                energy = (power + self.last_power) / 2 * elapsed / 3600
+                if status == "Discharging":
+                    self.discharge_wh += energy
+                elif status == "Charging":
+                    self.charge_wh += energy
+        self.last_timestamp = timestamp
+        self.last_power = power
+
+        self.voltage_end = battery_info.voltage
+
+        temperature = battery_info.temperature
+        if self.temperature_min is None or temperature < self.temperature_min:
+            self.temperature_min = temperature
+        if self.temperature_max is None or temperature > self.temperature_max:
+            self.temperature_max = temperature
+        self.temperature_sum += temperature
+
+        resistance = battery_info.resistance
+        if isinstance(resistance, int):
+            self.resistance_samples += 1
+            self.resistance_sum += resistance
+            if self.resistance_min is None or resistance < self.resistance_min:
+                self.resistance_min = resistance
+            if self.resistance_max is None or resistance > self.resistance_max:
+                self.resistance_max = resistance
+
+    def _finish_phase(self):
+        """
+        The charger reports capacity of the current phase only, in cycle mode every charge and discharge phase
+        starts from zero, so capacities of finished phases are summed. The counter keeps counting across a pause,
+        so only a change between charging and discharging finishes a phase.
+        """
+        if self.phase == "Charging":
+            self.charge_mah += self.phase_capacity
+        elif self.phase == "Discharging":
+            self.discharge_mah += self.phase_capacity
+        self.phase_capacity = 0
+
+    def finish(self, timestamp, status):
+        self._finish_phase()
+        self.phase = None
+        self.finished = timestamp
+        self.end_status = status
+
+    def to_dict(self):
+        charge_mah = self.charge_mah
+        discharge_mah = self.discharge_mah
+        if self.phase == "Charging":
+            charge_mah += self.phase_capacity
+        elif self.phase == "Discharging":
+            discharge_mah += self.phase_capacity
+
+        end = self.finished if self.finished is not None else self.last_timestamp
+        return {
+            "charger": self.charger,
+            "slot": self.slot,
+            "type": self.type,
+            "mode": self.mode,
+            "started": self.started,
+            "finished": self.finished,
+            "duration": end - self.started if end is not None else 0,
+            "status": self.end_status if self.finished is not None else self.status,
+            "frames": self.frames,
+            "charge_mah": charge_mah,
+            "discharge_mah": discharge_mah,
+            "charge_wh": round(self.charge_wh, 4),
+            "discharge_wh": round(self.discharge_wh, 4),
+            "voltage_start": self.voltage_start,
+            "voltage_end": self.voltage_end,
+            "temperature_min": self.temperature_min,
+            "temperature_max": self.temperature_max,
+            "temperature_avg": round(self.temperature_sum / self.frames, 2) if self.frames else None,
+            "resistance_samples": self.resistance_samples,
+            "resistance_min": self.resistance_min,
+            "resistance_max": self.resistance_max,
+            "resistance_avg": round(self.resistance_sum / self.resistance_samples, 1)
+            if self.resistance_samples else None,
+        }
+
+
+class SessionTracker:
+    """
+    Session engine over all chargers and slots. Keeps the running session of every slot and the last
+    `history` finished sessions, `listeners` are called with the summary dict of every finished session.
+    """
+
+    def __init__(self, history=100):
+        self.running = {}
+        self.finished = deque(maxlen=history)
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def update(self, battery_info, charger=None, timestamp=None):
+        """
+        Returns the summary of the session finished by given frame or None.
+        """
+        if timestamp is None:
+            timestamp = time()
+        key = (charger, battery_info.slot)
+        session = self.running.get(key)
+        status = battery_info.status
+
+        if status in ACTIVE_STATUSES:
+            if session is None:
+                session = self.running[key] = Session(charger, battery_info.slot, timestamp, battery_info)
+            session.update(timestamp, battery_info)
+            return None
+
+        if session is None:
+            return None
+
+        with self.lock:
+            del self.running[key]
+            session.finish(timestamp, status)
+            summary = session.to_dict()
+            self.finished.append(summary)
+        for listener in self.listeners:
+            listener(summary)
+        return summary
+
+    def get_running(self):
+        with self.lock:
+            return [session.to_dict() for session in list(self.running.values())]
+
+    def get_finished(self, charger=None, slot=None):
+        with self.lock:
+            finished = list(self.finished)
+        return [
+            summary for summary in finished
+            if (charger is None or summary["charger"] == charger) and (slot is None or summary["slot"] == slot)
+        ]
@@ -1,3 +1,7 @@
+import logging
+from time import monotonic
+
+
 def calculate_checksum(payload):
     sum = 0
     for byte in payload:
@@ -11,3 +15,32 @@ def compare_checksum(payload, settings=None):
 
     begin, end = settings
     return calculate_checksum(payload[begin:end]) != 0x100 - payload[end + 1]
+
+
+class RateLimitedLog:
+    """
+    Logs at most `burst` messages of every key per `period` seconds, further messages are only counted
+    and reported as one summary line when the next period of the key starts.
+    """
+
+    def __init__(self, period=60, burst=3):
+        self.period = period
+        self.burst = burst
+        # key: [period start, logged, suppressed]
+        self.windows = {}
+
+    def warning(self, key, message):
+        self.log(logging.WARNING, key, message)
+
+    def log(self, level, key, message):
+        now = monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.period:
+            if window is not None and window[2]:
+                logging.log(level, "%s: %s similar messages suppressed in %.0f s" % (key, window[2], now - window[0]))
+            window = self.windows[key] = [now, 0, 0]
+        if window[1] < self.burst:
+            window[1] += 1
+            logging.log(level, message)
+        else:
+            window[2] += 1
@@ -0,0 +1,478 @@
+"""
+In-process stand-in for `BleakClient` simulating MC3000 and MC5000 chargers. The USB device of MC3000
+is simulated by `usbsimulator.FakeUsbDevice`.
+
+A simulated charger answers slot requests of both protocols - MC3000 (0x55, slot index) and MC5000 (0x91, channel
+bitmask) - with frames encoded from scripted slot curves, after a configurable latency with jitter. Requests
+can be lost and replies corrupted (wrong checksum) with given probabilities, and a charger can be powered off
+to exercise disconnects and reconnects. The simulation is cheap - a charger is a handful of objects
+and every reply a single `call_later` on the running loop - so hundreds of chargers run on one loop.
+
+`Simulator().create_client` is a drop-in `client_factory` of `MC3000Ble`, `MC5000Ble`, `Fleet` and `gui.Server`.
+`python simulator.py [chargers] [duration]` runs a fleet of simulated chargers and prints the received frames.
+"""
+
+import asyncio
+import math
+import random
+import sys
+from time import monotonic
+
+import bleak
+
+from mc3000ble import MC3000Ble
+from mc5000ble import MC5000Ble
+from shared import calculate_checksum
+
+MC3000_REQUEST = MC3000Ble.BATTERY_INFO
+MC5000_REQUEST = MC5000Ble.SLOT_STATUS
+
+
+def reverse_labels(labels):
+    """
+    {label: code} of a {code: label} table, the first code wins for duplicate labels.
+    """
+    codes = {}
+    for code, label in labels.items():
+        codes.setdefault(label, code)
+    return codes
+
+
+MC3000_STATUS_CODES = reverse_labels(MC3000Ble.statuses)
+MC5000_STATUS_CODES = reverse_labels(MC5000Ble.statuses)
+MC3000_MODE_CODES = {battery_type: reverse_labels(modes) for battery_type, modes in MC3000Ble.mode_labels.items()}
+MC5000_MODE_CODES = {battery_type: reverse_labels(modes) for battery_type, modes in MC5000Ble.mode_labels.items()}
+
+
+def mc3000_frame(slot, status=1, voltage=3900, current=1000, capacity=500, seconds=600, temperature=25, resistance=50,
+                 battery_type=0, mode=0):
+    data = [
+        0x0F, 0x55, slot, battery_type, mode, 1, status,
+        seconds >> 8, seconds & 0xFF,
+        voltage >> 8, voltage & 0xFF,
+        current >> 8, current & 0xFF,
+        capacity >> 8, capacity & 0xFF,
+        temperature,
+        resistance >> 8, resistance & 0xFF,
+        1 << slot,
+        0x00,
+    ]
+    data[-1] = calculate_checksum(data[:-1])
+    return bytearray(data)
+
+
+def mc5000_frame(channel, status=2, voltage=3900, current=1000, capacity=500, seconds=600, temperature=25000,
+                 resistance=50, battery_type=0, mode=0, error=0):
+    data = [0x0F, 20, 0x91, channel]
+    data.extend(current.to_bytes(2, "big"))
+    data.extend(voltage.to_bytes(2, "big"))
+    data.extend(temperature.to_bytes(2, "big"))
+    data.extend(capacity.to_bytes(2, "big"))
+    data.extend(seconds.to_bytes(4, "big"))
+    data.extend(resistance.to_bytes(2, "big"))
+    data.extend([status, mode, error, battery_type])
+    data.append(calculate_checksum(data[2:]))
+    return bytearray(data)
+
+
+class SlotState:
+    """
+    State of a slot at one moment, in the units of `BatteryInfo` (V, A, mAh, °C, mΩ). `battery_type` is the type
+    index, lithium (0) and NiMH (3) mean the same in both protocols.
+    """
+
+    __slots__ = ("status", "mode", "battery_type", "seconds", "voltage", "current", "capacity", "temperature",
+                 "resistance")
+
+    def __init__(self, status, mode="Charge", battery_type=0, seconds=0, voltage=0.0, current=0.0, capacity=0,
+                 temperature=25, resistance=0):
+        self.status = status
+        self.mode = mode
+        self.battery_type = battery_type
+        self.seconds = seconds
+        self.voltage = voltage
+        self.current = current
+        self.capacity = capacity
+        self.temperature = temperature
+        self.resistance = resistance
+
+    def to_mc3000_frame(self, slot):
+        return mc3000_frame(
+            slot,
+            status=MC3000_STATUS_CODES.get(self.status, 0),
+            voltage=clamp(round(self.voltage * 1000), 0xFFFF),
+            current=clamp(round(self.current * 1000), 0xFFFF),
+            capacity=clamp(round(self.capacity), 0xFFFF),
+            seconds=clamp(int(self.seconds), 0xFFFF),
+            temperature=clamp(round(self.temperature), 0xFF),
+            resistance=clamp(self.resistance, 0xFFFF),
+            battery_type=self.battery_type,
+            mode=MC3000_MODE_CODES.get(self.battery_type, {}).get(self.mode, 0),
+        )
+
+    def to_mc5000_frame(self, slot):
+        return mc5000_frame(
+            MC5000Ble.slot_channels[slot],
+            status=MC5000_STATUS_CODES.get(self.status, 0),
+            voltage=clamp(round(self.voltage * 1000), 0xFFFF),
+            current=clamp(round(self.current * 1000), 0xFFFF),
+            capacity=clamp(round(self.capacity), 0xFFFF),
+            seconds=clamp(int(self.seconds), 0xFFFFFFFF),
+            temperature=clamp(round(self.temperature * 1000), 0xFFFF),
+            resistance=clamp(self.resistance, 0xFFFF),
+            battery_type=self.battery_type,
+            mode=MC5000_MODE_CODES.get(self.battery_type, {}).get(self.mode, 0),
+        )
+
+
+def clamp(value, maximum):
+    return min(max(value, 0), maximum)
+
+
+class Empty:
+    """
+    No battery in the slot.
+    """
+
+    def state(self, seconds):
+        return SlotState("Standby", resistance=0)
+
+
+class Idle:
+    """
+    A battery waiting in Standby.
+    """
+
+    def __init__(self, voltage=3.7, battery_type=0, resistance=50):
+        self.voltage = voltage
+        self.battery_type = battery_type
+        self.resistance = resistance
+
+    def state(self, seconds):
+        return SlotState("Standby", battery_type=self.battery_type, voltage=self.voltage, resistance=self.resistance)
+
+
+class Charge:
+    """
+    CC/CV charge of a lithium cell - constant `current` until the voltage reaches `end_voltage` (after
+    `cc_fraction` of the capacity), then the current decays exponentially with `time_constant`
+    until `end_current`, then Completed.
+    """
+
+    def __init__(self, capacity=2500, current=1.0, start_voltage=3.4, end_voltage=4.2, end_current=0.1,
+                 time_constant=1200, cc_fraction=0.8, battery_type=0, resistance=50):
+        self.current = current
+        self.start_voltage = start_voltage
+        self.end_voltage = end_voltage
+        self.time_constant = time_constant
+        self.battery_type = battery_type
+        self.resistance = resistance
+        self.cc_capacity = capacity * cc_fraction
+        self.cc_seconds = self.cc_capacity / (current * 1000) * 3600
+        self.cv_seconds = time_constant * math.log(current / end_current) if current > end_current else 0
+        self.duration = self.cc_seconds + self.cv_seconds
+
+    def get_capacity(self, seconds):
+        if seconds <= self.cc_seconds:
+            return self.current * 1000 * seconds / 3600
+        elapsed = min(seconds, self.duration) - self.cc_seconds
+        decayed = 1 - math.exp(-elapsed / self.time_constant)
+        return self.cc_capacity + self.current * 1000 * self.time_constant * decayed / 3600
+
+    def state(self, seconds):
+        capacity = self.get_capacity(seconds)
+        if seconds >= self.duration:
+            return SlotState(
+                "Completed", "Charge", self.battery_type, self.duration, self.end_voltage - 0.02, 0.0, capacity,
+                25, self.resistance,
+            )
+        if seconds < self.cc_seconds:
+            progress = seconds / self.cc_seconds
+            voltage = self.start_voltage + (self.end_voltage - self.start_voltage) * math.sqrt(progress)
+            current = self.current
+        else:
+            voltage = self.end_voltage
+            current = self.current * math.exp(-(seconds - self.cc_seconds) / self.time_constant)
+        temperature = 25 + 8 * current / self.current
+        return SlotState(
+            "Charging", "Charge", self.battery_type, seconds, voltage, current, capacity, temperature, self.resistance,
+        )
+
+
+class Discharge:
+    """
+    Constant current discharge of `capacity` with the voltage falling from `start_voltage` to `cut_voltage`,
+    steeply at the end, then Completed.
+    """
+
+    def __init__(self, capacity=2500, current=0.5, start_voltage=4.1, cut_voltage=2.8, battery_type=0, resistance=50):
+        self.current = current
+        self.start_voltage = start_voltage
+        self.cut_voltage = cut_voltage
+        self.battery_type = battery_type
+        self.resistance = resistance
+        self.capacity = capacity
+        self.duration = capacity / (current * 1000) * 3600
+
+    def state(self, seconds):
+        if seconds >= self.duration:
+            return SlotState(
+                "Completed", "Discharge", self.battery_type, self.duration, self.cut_voltage + 0.3, 0.0,
+                self.capacity, 25, self.resistance,
+            )
+        progress = seconds / self.duration
+        voltage = self.start_voltage - (self.start_voltage - self.cut_voltage) * progress ** 3
+        return SlotState(
+            "Discharging", "Discharge", self.battery_type, seconds, voltage, self.current,
+            self.current * 1000 * seconds / 3600, 27, self.resistance,
+        )
+
+
+class Script:
+    """
+    Curves played one after another, `steps` are (curve, seconds) pairs - the last step lasts forever
+    and its seconds are ignored.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def state(self, seconds):
+        for curve, duration in self.steps[:-1]:
+            if seconds < duration:
+                return curve.state(seconds)
+            seconds -= duration
+        return self.steps[-1][0].state(seconds)
+
+
+class SimulatedCharger:
+    """
+    A charger with 4 slots playing `curves` (objects with `state(seconds)`), `speed` times faster than real time.
+    Every request is answered after `latency` ± `jitter` seconds, lost with probability `loss` and its reply
+    has a wrong checksum with probability `corrupt`.
+    """
+
+    def __init__(self, address, curves=None, speed=1, latency=0.010, jitter=0.005, loss=0.0, corrupt=0.0, seed=None,
+                 offset=0):
+        self.address = address
+        self.curves = curves if curves is not None else [Charge(), Discharge(), Idle(), Empty()]
+        self.speed = speed
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.corrupt = corrupt
+        self.random = random.Random(seed)
+        # simulated seconds already elapsed at start, so chargers of a fleet aren't in lockstep
+        self.started = monotonic() - offset / speed
+        self.powered = True
+        self.clients = []
+        self.requests = 0
+        self.replies = 0
+
+    def get_seconds(self):
+        return (monotonic() - self.started) * self.speed
+
+    def state(self, slot):
+        return self.curves[slot].state(self.get_seconds())
+
+    def respond(self, data):
+        """
+        (delay, reply frame) for a request or None when there is no reply.
+        """
+        self.requests += 1
+        if data[1] == MC3000_REQUEST:
+            slot = data[2]
+            if slot >= len(self.curves):
+                return None
+            frame = self.state(slot).to_mc3000_frame(slot)
+        elif data[2] == MC5000_REQUEST:
+            slot = MC5000Ble.channel_slots.get(data[3])
+            if slot is None or slot >= len(self.curves):
+                return None
+            frame = self.state(slot).to_mc5000_frame(slot)
+        else:
+            return None
+
+        if self.loss and self.random.random() < self.loss:
+            return None
+        if self.corrupt and self.random.random() < self.corrupt:
+            frame[-1] ^= 0xFF
+        self.replies += 1
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        return max(delay, 0), frame
+
+    def power_off(self):
+        self.powered = False
+        for client in list(self.clients):
+            client.drop()
+
+    def power_on(self):
+        self.powered = True
+
+
+class SimulatedClient:
+    """
+    `BleakClient` subset used by the services - connect/disconnect as an async context manager, notifications
+    and writes of the charger characteristic.
+    """
+
+    def __init__(self, charger, disconnected_callback=None):
+        self.charger = charger
+        self.address = charger.address
+        self.disconnected_callback = disconnected_callback
+        self.callback = None
+        self.is_connected = False
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.disconnect()
+
+    async def connect(self, **kwargs):
+        if not self.charger.powered:
+            raise bleak.BleakError("device %s not found" % self.address)
+        self.is_connected = True
+        self.charger.clients.append(self)
+        return True
+
+    async def disconnect(self):
+        if self.is_connected:
+            self.is_connected = False
+            self.charger.clients.remove(self)
+        return True
+
+    async def start_notify(self, uuid, callback, **kwargs):
+        self.callback = callback
+
+    async def stop_notify(self, uuid):
+        self.callback = None
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        if not self.is_connected:
+            raise bleak.BleakError("not connected")
+        reply = self.charger.respond(data)
+        if reply is not None:
+            delay, frame = reply
+            asyncio.get_running_loop().call_later(delay, self._notify, frame)
+
+    def _notify(self, frame):
+        if self.is_connected and self.callback is not None:
+            asyncio.ensure_future(self.callback(None, frame))
+
+    def drop(self):
+        """
+        Connection lost on the charger side (powered off, out of range).
+        """
+        if self.is_connected:
+            self.is_connected = False
+            self.charger.clients.remove(self)
+            if self.disconnected_callback is not None:
+                self.disconnected_callback(self)
+
+
+class Simulator:
+    """
+    Simulated chargers by address, created on first connect with the defaults given here. Every charger gets
+    its own random generator (derived from `seed` and the address) and a random offset of its curves.
+    """
+
+    def __init__(self, speed=1, latency=0.010, jitter=0.005, loss=0.0, corrupt=0.0, seed=0, curves_factory=None,
+                 max_offset=3600):
+        self.speed = speed
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.corrupt = corrupt
+        self.seed = seed
+        self.curves_factory = curves_factory
+        self.max_offset = max_offset
+        self.chargers = {}
+
+    def add_charger(self, address, **kwargs):
+        seed = "%s-%s" % (self.seed, address)
+        parameters = {
+            "curves": self.curves_factory() if self.curves_factory is not None else None,
+            "speed": self.speed,
+            "latency": self.latency,
+            "jitter": self.jitter,
+            "loss": self.loss,
+            "corrupt": self.corrupt,
+            "seed": seed,
+            "offset": random.Random(seed).uniform(0, self.max_offset),
+        }
+        parameters.update(kwargs)
+        charger = self.chargers[address] = SimulatedCharger(address, **parameters)
+        return charger
+
+    def get_charger(self, address):
+        charger = self.chargers.get(address)
+        if charger is None:
+            charger = self.add_charger(address)
+        return charger
+
+    def create_client(self, device, disconnected_callback=None, **kwargs):
+        """
+        `client_factory` - `device` is an address or a BLEDevice.
+        """
+        address = getattr(device, "address", device)
+        return SimulatedClient(self.get_charger(address), disconnected_callback)
+
+
+def write_capture(path, model="mc3000", curves=None, duration=3600, interval=10):
+    """
+    Capture (see `capture.CaptureWriter`) of `duration` simulated seconds of a charger playing `curves`,
+    every slot sampled every `interval` seconds. Written right away, not in real time.
+    """
+    from capture import CaptureWriter
+
+    curves = curves if curves is not None else [Charge(), Discharge(), Idle(), Empty()]
+    writer = CaptureWriter(path, model)
+    try:
+        seconds = 0
+        while seconds <= duration:
+            for slot, curve in enumerate(curves):
+                state = curve.state(seconds)
+                if model == "mc5000":
+                    writer.write(state.to_mc5000_frame(slot), seconds)
+                else:
+                    writer.write(state.to_mc3000_frame(slot), seconds)
+            seconds += interval
+    finally:
+        writer.close()
+    return writer.count
+
+
+def create_addresses(count):
+    return ["00:00:00:00:%02X:%02X" % (index >> 8, index & 0xFF) for index in range(count)]
+
+
+class DebugPrint:
+    def __init__(self, count, speed=60):
+        from fleet import Charger, Fleet
+
+        self.simulator = Simulator(speed=speed)
+        chargers = [
+            Charger("sim-%s" % index, address, model="mc3000" if index % 2 == 0 else "mc5000")
+            for index, address in enumerate(create_addresses(count))
+        ]
+        self.fleet = Fleet(chargers, client_factory=self.simulator.create_client)
+
+    def run(self, duration):
+        async def run():
+            asyncio.get_running_loop().call_later(duration, self.fleet.stop)
+            await self.fleet.run_async(self.receive_callback)
+
+        asyncio.run(run())
+
+    def receive_callback(self, battery_info, charger):
+        print(charger, battery_info)
+
+
+if __name__ == "__main__":
+    # usage: simulator.py [chargers] [duration]
+    try:
+        DebugPrint(int(sys.argv[1]) if len(sys.argv) > 1 else 2).run(float(sys.argv[2]) if len(sys.argv) > 2 else 5)
+    except KeyboardInterrupt:
+        exit(1)
@@ -0,0 +1,91 @@
+from collections import deque
+import threading
+
+
+class Subscription:
+    """
+    Bounded queue of one streaming client. When the client doesn't keep up the oldest messages are dropped,
+    so a slow client never blocks the publisher.
+    """
+
+    def __init__(self, size):
+        self.queue = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, message):
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(message)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Next message or None when nothing arrived within timeout or the subscription was closed.
+        """
+        with self.condition:
+            if not self.queue and not self.closed:
+                self.condition.wait(timeout)
+            if self.queue:
+                return self.queue.popleft()
+            return None
+
+    def take_dropped(self):
+        with self.condition:
+            dropped = self.dropped
+            self.dropped = 0
+            return dropped
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class Broadcaster:
+    """
+    Fans out server-sent events to any number of subscriptions. Messages are encoded once per publish
+    and the same string is queued to every subscription.
+    """
+
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def has_subscribers(self):
+        return len(self.subscriptions) > 0
+
+    def subscribe(self):
+        subscription = Subscription(self.queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+        subscription.close()
+
+    def publish(self, event, data):
+        """
+        `data` is already serialized JSON.
+        """
+        message = encode_event(event, data)
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def close(self):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+            self.subscriptions = set()
+        for subscription in subscriptions:
+            subscription.close()
+
+
+def encode_event(event, data):
+    return "event: %s\ndata: %s\n\n" % (event, data)
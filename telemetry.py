@@ -0,0 +1,68 @@
+import pendulum
+
+NO_RESISTANCE = frozenset([0, 1, 65535])
+
+
+def build_mode_labels(modes, modes_types_mapping):
+    """
+    Flattens `modes` and `modes_types_mapping` into {type_index: {mode_index: label}} for O(1) mode lookups.
+    """
+    labels = {}
+    for mode_group, applicable_types in modes_types_mapping.items():
+        for battery_type in applicable_types:
+            if battery_type not in labels:
+                labels[battery_type] = modes[mode_group]
+    return labels
+
+
+class BatteryInfo:
+    """
+    Decoded state of one slot - compact replacement of the per-frame dict.
+
+    Fields not provided by given charger model (`count` on MC5000, `error` on MC3000) are None
+    and are left out of `to_dict()`.
+    """
+
+    __slots__ = (
+        "slot", "type", "mode", "count", "status", "error", "seconds", "voltage", "current", "capacity",
+        "temperature", "resistance", "led",
+    )
+
+    def __init__(self, slot, type, mode, count, status, error, seconds, voltage, current, capacity, temperature,
+                 resistance, led):
+        self.slot = slot
+        self.type = type
+        self.mode = mode
+        self.count = count
+        self.status = status
+        self.error = error
+        self.seconds = seconds
+        self.voltage = voltage
+        self.current = current
+        self.capacity = capacity
+        self.temperature = temperature
+        self.resistance = resistance
+        self.led = led
+
+    def to_dict(self):
+        battery_info = {
+            "slot": self.slot,
+            "type": self.type,
+            "mode": self.mode,
+        }
+        if self.count is not None:
+            battery_info["count"] = self.count
+        battery_info["status"] = self.status
+        if self.error is not None:
+            battery_info["error"] = self.error
+        battery_info["time"] = pendulum.duration(seconds=self.seconds)
+        battery_info["voltage"] = self.voltage
+        battery_info["current"] = self.current
+        battery_info["capacity"] = self.capacity
+        battery_info["temperature"] = self.temperature
+        battery_info["resistance"] = self.resistance
+        battery_info["led"] = self.led
+        return battery_info
+
+    def __repr__(self):
+        return "BatteryInfo(%s)" % ", ".join("%s=%r" % (name, getattr(self, name)) for name in self.__slots__)
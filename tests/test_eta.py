@@ -0,0 +1,54 @@
+"""
+Completion time estimates replayed from captures against the actual completion.
+
+`data/eta-mc3000.cap` was generated by the simulator - a 1000 mAh CC/CV charge at 1 A in slot 1 and a 1000 mAh
+discharge at 1 A in slot 2, every slot sampled every 20 s:
+
+    simulator.write_capture(path, "mc3000", [Charge(capacity=1000), Discharge(capacity=1000, current=1.0)],
+                            duration=5700, interval=20)
+"""
+
+import os
+
+from eta import Targets, evaluate
+from simulator import Charge, Discharge, write_capture
+
+CAPTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "eta-mc3000.cap")
+
+CHECKPOINTS = (0.25, 0.5, 0.75, 0.9)
+
+# relative error allowed of the CC/CV charge model and of the capacity slope against a known target capacity,
+# the voltage approach of a discharge without a target capacity isn't bounded (the discharge curve is flat, then steep)
+CHARGE_TOLERANCE = 0.10
+CAPACITY_TOLERANCE = 0.05
+
+
+def get_errors(results, status):
+    phases = [result for result in results if result["status"] == status]
+    assert len(phases) == 1
+    errors = []
+    for checkpoint, eta, actual in phases[0]["checkpoints"]:
+        assert eta is not None, "no estimate at %s%% of %s" % (checkpoint * 100, status)
+        errors.append(abs(eta - actual) / actual)
+    return errors
+
+
+def test_charge_estimate_within_tolerance():
+    errors = get_errors(evaluate(CAPTURE, CHECKPOINTS), "Charging")
+    assert max(errors) <= CHARGE_TOLERANCE, errors
+
+
+def test_discharge_estimate_with_target_capacity_within_tolerance():
+    results = evaluate(CAPTURE, CHECKPOINTS, Targets(capacities={"LiIon": 1000}))
+    errors = get_errors(results, "Discharging")
+    assert max(errors) <= CAPACITY_TOLERANCE, errors
+
+
+def test_mc5000_charge_estimate_within_tolerance(tmp_path):
+    path = str(tmp_path / "eta-mc5000.cap")
+    write_capture(path, "mc5000", [Charge(capacity=1000), Discharge(capacity=1000, current=1.0)], duration=5700,
+                  interval=20)
+
+    results = evaluate(path, CHECKPOINTS, Targets(capacities={"Li-ion": 1000}))
+    assert max(get_errors(results, "Charging")) <= CHARGE_TOLERANCE
+    assert max(get_errors(results, "Discharging")) <= CAPACITY_TOLERANCE
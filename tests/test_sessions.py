@@ -0,0 +1,51 @@
+from sessions import SessionTracker
+from telemetry import BatteryInfo
+
+
+def frame(status, capacity, current=1.0, slot=0):
+    return BatteryInfo(slot, "LiIon", "Charge", None, status, None, 0, 3.9, current, capacity, 25, 50, "red")
+
+
+def run(tracker, frames):
+    summary = None
+    for timestamp, (status, capacity) in enumerate(frames):
+        summary = tracker.update(frame(status, capacity), timestamp=timestamp) or summary
+    return summary
+
+
+def test_charge_capacity_is_counted_once_across_a_pause():
+    # the capacity counter keeps counting across the pause
+    summary = run(SessionTracker(), [
+        ("Charging", 100), ("Charging", 500),
+        ("Pause", 500), ("Pause", 500),
+        ("Charging", 600), ("Charging", 1000),
+        ("Completed", 1000),
+    ])
+
+    assert summary["charge_mah"] == 1000
+    assert summary["discharge_mah"] == 0
+    assert summary["status"] == "Completed"
+
+
+def test_cycle_phases_are_summed():
+    # every charge and discharge phase of a cycle starts counting from zero, separated by a rest
+    summary = run(SessionTracker(), [
+        ("Discharging", 200), ("Discharging", 900),
+        ("Resting", 900), ("Resting", 0),
+        ("Charging", 300), ("Charging", 1000),
+        ("Resting", 1000),
+        ("Discharging", 100), ("Discharging", 950),
+        ("Completed", 950),
+    ])
+
+    assert summary["charge_mah"] == 1000
+    assert summary["discharge_mah"] == 1850
+
+
+def test_running_session_includes_current_phase():
+    tracker = SessionTracker()
+    run(tracker, [("Charging", 100), ("Pause", 400), ("Charging", 700)])
+
+    running = tracker.get_running()
+    assert len(running) == 1
+    assert running[0]["charge_mah"] == 700
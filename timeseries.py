@@ -0,0 +1,398 @@
+"""
+Append-only, fixed-width, memory-mapped time-series of slot telemetry.
+
+Every charger slot has one raw series file plus one rollup file per resolution. Files are preallocated
+in chunks and memory-mapped, appending a sample only packs the record into the map and bumps the count
+in the header, so it's O(1) and RAM doesn't grow with the length of a charge. Growing a file only extends it,
+existing records are never rewritten. Records are ordered by time which allows binary search for range queries.
+"""
+
+import contextlib
+import mmap
+import os
+import re
+import struct
+import threading
+from time import time
+
+import config
+
+HEADER = struct.Struct("<4sIQ")  # magic, record size, count
+COUNT = struct.Struct("<Q")
+COUNT_OFFSET = 8
+MAGIC = b"MCTS"
+
+# timestamp, voltage, current, temperature, capacity, resistance (0 = n/a)
+SAMPLE = struct.Struct("<dfffIH2x")
+
+# bucket start, sample count, voltage min/max/avg, current min/max/avg, temperature min/max/avg, last capacity
+BUCKET = struct.Struct("<dIfffffffffI")
+
+TIMESTAMP = struct.Struct("<d")
+
+RESOLUTIONS = (10, 60, 600)
+
+# columns of raw samples and their averages in rollup buckets
+METRICS = {
+    "voltage": (1, 4),
+    "current": (2, 7),
+    "temperature": (3, 10),
+    "capacity": (4, 11),
+}
+
+# the raw series is used for charts only up to this many samples, longer ranges use the finest rollup that fits
+CHART_SAMPLES_MAX = 20000
+
+
+class Series:
+    def __init__(self, path, record, chunk=4096):
+        self.path = path
+        self.record = record
+        self.chunk = chunk
+        self.lock = threading.Lock()
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= HEADER.size
+        self.file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self.file.write(HEADER.pack(MAGIC, record.size, 0))
+            self.file.truncate(HEADER.size + chunk * record.size)
+            self.file.flush()
+
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, record_size, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or record_size != record.size:
+            self.close()
+            raise TimeSeriesException("'%s' is not a series of %s byte records" % (path, record.size))
+        self.capacity = (len(self.map) - HEADER.size) // record.size
+
+    def append(self, *values):
+        with self.lock:
+            if self.count >= self.capacity:
+                self._grow()
+            self.record.pack_into(self.map, HEADER.size + self.count * self.record.size, *values)
+            self.count += 1
+            COUNT.pack_into(self.map, COUNT_OFFSET, self.count)
+
+    def _grow(self):
+        size = len(self.map) + self.chunk * self.record.size
+        self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.capacity = (size - HEADER.size) // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def read(self, index):
+        return self.record.unpack_from(self.map, HEADER.size + index * self.record.size)
+
+    def bisect(self, timestamp):
+        """
+        Index of the first record with timestamp >= given timestamp.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if TIMESTAMP.unpack_from(self.map, HEADER.size + middle * self.record.size)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start=None, end=None):
+        with self.lock:
+            first = 0 if start is None else self.bisect(start)
+            last = self.count if end is None else self.bisect(end)
+            offset = HEADER.size + first * self.record.size
+            return list(self.record.iter_unpack(self.map[offset:HEADER.size + last * self.record.size]))
+
+    def flush(self):
+        with self.lock:
+            self.map.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.map.closed:
+                self.map.flush()
+                self.map.close()
+            self.file.close()
+
+
+class Rollup:
+    """
+    Downsampled series - min/max/avg of voltage, current and temperature per bucket of `resolution` seconds.
+    Only the bucket being filled is kept in memory, it's appended to the file when the next bucket begins.
+    The lock keeps the bucket and the file consistent for readers on other threads.
+    """
+
+    def __init__(self, path, resolution):
+        self.resolution = resolution
+        self.series = Series(path, BUCKET, chunk=256)
+        self.bucket = None
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, voltage, current, temperature, capacity):
+        start = timestamp - timestamp % self.resolution
+        with self.lock:
+            bucket = self.bucket
+            if bucket is not None and bucket[0] != start:
+                self.series.append(*self._finish(bucket))
+                bucket = None
+
+            if bucket is None:
+                self.bucket = [start, 1, voltage, voltage, voltage, current, current, current,
+                               temperature, temperature, temperature, capacity]
+                return
+
+            bucket[1] += 1
+            self._accumulate(bucket, 2, voltage)
+            self._accumulate(bucket, 5, current)
+            self._accumulate(bucket, 8, temperature)
+            bucket[11] = capacity
+
+    def _accumulate(self, bucket, index, value):
+        if value < bucket[index]:
+            bucket[index] = value
+        if value > bucket[index + 1]:
+            bucket[index + 1] = value
+        bucket[index + 2] += value
+
+    def _finish(self, bucket):
+        count = bucket[1]
+        finished = list(bucket)
+        finished[4] /= count
+        finished[7] /= count
+        finished[10] /= count
+        return finished
+
+    def range(self, start=None, end=None):
+        with self.lock:
+            buckets = self.series.range(start, end)
+            bucket = self.bucket
+            if bucket is not None and (start is None or bucket[0] >= start) and (end is None or bucket[0] < end):
+                buckets.append(tuple(self._finish(bucket)))
+        return buckets
+
+    def close(self):
+        with self.lock:
+            if self.bucket is not None:
+                self.series.append(*self._finish(self.bucket))
+                self.bucket = None
+            self.series.close()
+
+
+class SlotSeries:
+    def __init__(self, directory, slot, resolutions=RESOLUTIONS):
+        self.raw = Series(self.get_raw_path(directory, slot), SAMPLE)
+        self.rollups = {}
+        for resolution in resolutions:
+            self.rollups[resolution] = Rollup(self.get_rollup_path(directory, slot, resolution), resolution)
+
+    @staticmethod
+    def get_raw_path(directory, slot):
+        return os.path.join(directory, "slot-%s.bin" % slot)
+
+    @staticmethod
+    def get_rollup_path(directory, slot, resolution):
+        return os.path.join(directory, "slot-%s-%ss.bin" % (slot, resolution))
+
+    @classmethod
+    def exists(cls, directory, slot, resolutions=RESOLUTIONS):
+        paths = [cls.get_raw_path(directory, slot)]
+        paths.extend(cls.get_rollup_path(directory, slot, resolution) for resolution in resolutions)
+        return all(os.path.exists(path) for path in paths)
+
+    def append(self, timestamp, battery_info):
+        resistance = battery_info.resistance
+        if not isinstance(resistance, int):
+            resistance = 0
+        voltage = battery_info.voltage
+        current = battery_info.current
+        temperature = battery_info.temperature
+        capacity = battery_info.capacity
+        self.raw.append(timestamp, voltage, current, temperature, capacity, resistance)
+        for rollup in self.rollups.values():
+            rollup.append(timestamp, voltage, current, temperature, capacity)
+
+    def close(self):
+        self.raw.close()
+        for rollup in self.rollups.values():
+            rollup.close()
+
+
+class TimeSeriesStore:
+    """
+    One raw series and its rollups per charger and slot under `<data_dir>/series/<charger>/`.
+    Slots in Standby are not recorded. Frames without a charger (single charger monitors) are stored
+    under `default_charger` - the MC3000 and MC5000 monitors share the data directory, so each uses its model.
+    """
+
+    def __init__(self, directory=None, resolutions=RESOLUTIONS, default_charger="default"):
+        self.directory = directory or os.path.join(config.data_dir, "series")
+        self.resolutions = resolutions
+        self.default_charger = default_charger
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def get_slot_series(self, charger, slot):
+        key = (charger, slot)
+        series = self.slots.get(key)
+        if series is None:
+            with self.lock:
+                series = self.slots.get(key)
+                if series is None:
+                    directory = self.get_slot_directory(charger)
+                    if not os.path.exists(directory):
+                        os.makedirs(directory)
+                    series = self.slots[key] = SlotSeries(directory, slot, self.resolutions)
+        return series
+
+    @contextlib.contextmanager
+    def read_slot_series(self, charger, slot):
+        """
+        Series of the slot for reading, None when the slot has never been recorded. Unlike `get_slot_series`
+        never creates files - series not being appended to by this process are opened only for the read.
+        """
+        series = self.slots.get((charger, slot))
+        if series is not None:
+            yield series
+            return
+
+        directory = self.get_slot_directory(charger)
+        if not SlotSeries.exists(directory, slot, self.resolutions):
+            yield None
+            return
+
+        series = SlotSeries(directory, slot, self.resolutions)
+        try:
+            yield series
+        finally:
+            series.close()
+
+    def get_slot_directory(self, charger):
+        return os.path.join(self.directory, self.get_charger_directory(charger))
+
+    def get_charger_directory(self, charger):
+        if charger is None:
+            charger = self.default_charger
+        return re.sub(r"[^\w-]", "-", str(charger))
+
+    def append(self, battery_info, charger=None, timestamp=None):
+        if battery_info.status == "Standby":
+            return
+        if timestamp is None:
+            timestamp = time()
+        self.get_slot_series(charger, battery_info.slot).append(timestamp, battery_info)
+
+    def query(self, charger, slot, start=None, end=None, resolution=None):
+        """
+        Raw samples (timestamp, voltage, current, temperature, capacity, resistance) or, with resolution,
+        rollup buckets (start, count, voltage min/max/avg, current min/max/avg, temperature min/max/avg, capacity)
+        within [start, end). Empty when the slot has never been recorded.
+        """
+        self.check_resolution(resolution)
+        with self.read_slot_series(charger, slot) as series:
+            if series is None:
+                return []
+            return self._query(series, start, end, resolution)
+
+    def count(self, charger, slot, start=None, end=None, resolution=None):
+        self.check_resolution(resolution)
+        with self.read_slot_series(charger, slot) as series:
+            if series is None:
+                return 0
+            return self._count(series, start, end, resolution)
+
+    def check_resolution(self, resolution):
+        if resolution is not None and resolution not in self.resolutions:
+            raise TimeSeriesException("unsupported resolution %s, available: %s" % (resolution, self.resolutions))
+
+    def _query(self, series, start, end, resolution):
+        if resolution is None:
+            return series.raw.range(start, end)
+        return series.rollups[resolution].range(start, end)
+
+    def _count(self, series, start, end, resolution):
+        series = series.raw if resolution is None else series.rollups[resolution].series
+        with series.lock:
+            first = 0 if start is None else series.bisect(start)
+            last = series.count if end is None else series.bisect(end)
+        return last - first
+
+    def query_chart(self, charger, slot, start=None, points=500):
+        """
+        Chart data {metric: [[timestamp, value], ...]} of samples newer than `start`, every metric
+        downsampled to at most `points` points with LTTB.
+        """
+        with self.read_slot_series(charger, slot) as series:
+            if series is None:
+                return {metric: [] for metric in METRICS}
+
+            resolution = None
+            if self._count(series, start, None, None) > CHART_SAMPLES_MAX:
+                for resolution in self.resolutions:
+                    if self._count(series, start, None, resolution) <= CHART_SAMPLES_MAX:
+                        break
+
+            rows = self._query(series, start, None, resolution)
+
+        if start is not None and rows and rows[0][0] == start:
+            rows = rows[1:]
+
+        chart = {}
+        for metric, (raw_column, rollup_column) in METRICS.items():
+            column = raw_column if resolution is None else rollup_column
+            chart[metric] = lttb([[row[0], round(row[column], 3)] for row in rows], points)
+        return chart
+
+    def close(self):
+        with self.lock:
+            for series in self.slots.values():
+                series.close()
+            self.slots = {}
+
+
+def lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling of [x, y] points to `threshold` points.
+    Keeps the first and last point and from every bucket the point forming the largest triangle
+    with the previously selected point and the average of the next bucket, which preserves the shape of the curve.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return points
+
+    sampled = [points[0]]
+    every = (count - 2) / (threshold - 2)
+    selected = 0
+    for bucket in range(threshold - 2):
+        average_start = int((bucket + 1) * every) + 1
+        average_end = min(int((bucket + 2) * every) + 1, count)
+        average_count = average_end - average_start
+        average_x = 0
+        average_y = 0
+        for index in range(average_start, average_end):
+            average_x += points[index][0]
+            average_y += points[index][1]
+        average_x /= average_count
+        average_y /= average_count
+
+        selected_x, selected_y = points[selected]
+        largest_area = -1
+        largest = None
+        for index in range(int(bucket * every) + 1, int((bucket + 1) * every) + 1):
+            x, y = points[index]
+            area = abs((selected_x - average_x) * (y - selected_y) - (selected_x - x) * (average_y - selected_y))
+            if area > largest_area:
+                largest_area = area
+                largest = index
+
+        sampled.append(points[largest])
+        selected = largest
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class TimeSeriesException(Exception):
+    pass
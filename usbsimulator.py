@@ -0,0 +1,171 @@
+"""
+In-process stand-in for the pyusb device of the MC3000 USB connection (`mc3000usb.MC3000Usb`), no hardware needed.
+
+`MC3000Usb(find_device=lambda: FakeUsbDevice())` runs the whole session - claiming, transfers, timeouts
+and recovery from unplugging - against the emulated slot settings protocol.
+"""
+
+from array import array
+from collections import deque
+import errno
+
+from usb.core import USBError, USBTimeoutError
+
+
+class FakeUsbDevice:
+    """
+    The part of `usb.core.Device` used by `MC3000Usb`, emulating the slot settings protocol of MC3000 - slot
+    settings reads (0x5F) are answered from `slots` (`SlotSettings` field dicts), writes (0x11) update them,
+    the system settings read (0x5A) is answered with zeros. `unplug()` makes every operation fail like
+    a disconnected device, after `plug()` the handle opened before stays invalid (like a libusb handle
+    of a replugged device) until its resources are disposed.
+    """
+
+    MESSAGE_SIZE = 64
+
+    # field: (index in the read reply, index in the write request, size)
+    LAYOUT = {
+        "battery_type": (3, 5, 1),
+        "operation_mode": (4, 8, 1),
+        "capacity": (5, 6, 2),
+        "charge_current": (7, 9, 2),
+        "discharge_current": (9, 11, 2),
+        "discharge_cut_voltage": (11, 13, 2),
+        "charge_end_voltage": (13, 15, 2),
+        "charge_end_current": (15, 17, 2),
+        "discharge_reduce_current": (17, 19, 2),
+        "number_cycle": (19, 21, 1),
+        "charge_resting_time": (20, 22, 1),
+        "cycle_mode": (21, 24, 1),
+        "peak_sense_voltage": (22, 25, 1),
+        "trickle_current": (23, 26, 1),
+        "restart_voltage": (24, 31, 2),
+        "cut_temperature": (26, 28, 1),
+        "cut_time": (27, 29, 2),
+        "temperature_unit": (29, None, 1),
+        "trickle_time": (30, 27, 1),
+        "discharge_resting_time": (31, 23, 1),
+    }
+
+    DEFAULT_SLOT = {
+        "battery_type": 0,
+        "operation_mode": 0,
+        "capacity": 0,
+        "charge_current": 1000,
+        "discharge_current": 500,
+        "discharge_cut_voltage": 2800,
+        "charge_end_voltage": 4200,
+        "charge_end_current": 100,
+        "discharge_reduce_current": 50,
+        "number_cycle": 1,
+        "charge_resting_time": 10,
+        "cycle_mode": 0,
+        "peak_sense_voltage": 3,
+        "trickle_current": 50,
+        "restart_voltage": 4100,
+        "cut_temperature": 45,
+        "cut_time": 720,
+        "temperature_unit": 0,
+        "trickle_time": 0,
+        "discharge_resting_time": 10,
+    }
+
+    def __init__(self, slots=None):
+        self.slots = slots if slots is not None else [dict(self.DEFAULT_SLOT) for _ in range(4)]
+        self.replies = deque()
+        self.plugged = True
+        self.configured = False
+        self.stale = False
+        self.claimed = set()
+        self.writes = 0
+        self.reads = 0
+        # handle management of `usb.util.claim_interface`, `release_interface` and `dispose_resources`
+        self._ctx = FakeUsbContext()
+
+    def is_kernel_driver_active(self, interface):
+        self.check_plugged()
+        return False
+
+    def get_active_configuration(self):
+        self.check_plugged()
+        if not self.configured:
+            raise USBError("Configuration not set")
+        return 1
+
+    def set_configuration(self, configuration=None):
+        self.check_plugged()
+        self.configured = True
+
+    def write(self, endpoint, data, timeout=None):
+        self.check_plugged()
+        self.writes += 1
+        command = data[2]
+        if command == 0x5F:
+            self.replies.append(self.encode_slot(data[4]))
+        elif command == 0x11:
+            self.decode_slot(data)
+        elif command == 0x5A:
+            self.replies.append(self.finish_reply([0x0F] + [0x00] * (self.MESSAGE_SIZE - 1)))
+        return len(data)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        self.check_plugged()
+        self.reads += 1
+        if not self.replies:
+            raise USBTimeoutError("Operation timed out", errno=errno.ETIMEDOUT)
+        return self.replies.popleft()
+
+    def encode_slot(self, slot_number):
+        return self.encode_settings(slot_number, self.slots[slot_number])
+
+    def encode_settings(self, slot_number, fields):
+        data = [0x00] * self.MESSAGE_SIZE
+        data[0] = 0x0F
+        data[1] = slot_number
+        for name, (index, _, size) in self.LAYOUT.items():
+            value = fields[name]
+            if size == 2:
+                data[index] = value >> 8
+                data[index + 1] = value & 0xFF
+            else:
+                data[index] = value
+        return self.finish_reply(data)
+
+    def finish_reply(self, data):
+        data[-1] = sum(data[:-1]) & 0xFF
+        return array("B", data)
+
+    def decode_slot(self, data):
+        fields = self.slots[data[4]]
+        for name, (_, index, size) in self.LAYOUT.items():
+            if index is None:
+                continue
+            fields[name] = (data[index] << 8) + data[index + 1] if size == 2 else data[index]
+
+    def check_plugged(self):
+        if not self.plugged or self.stale:
+            raise USBError("No such device (it may have been disconnected)", errno=errno.ENODEV)
+
+    def unplug(self):
+        self.plugged = False
+        self.configured = False
+        self.replies.clear()
+        if self.claimed:
+            self.stale = True
+
+    def plug(self):
+        self.plugged = True
+
+
+class FakeUsbContext:
+    def managed_claim_interface(self, device, interface):
+        device.check_plugged()
+        device.claimed.add(interface)
+
+    def managed_release_interface(self, device, interface):
+        device.check_plugged()
+        device.claimed.discard(interface)
+
+    def dispose(self, device, close_handle=True):
+        device.claimed.clear()
+        device.stale = False